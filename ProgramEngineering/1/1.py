@@ -1,9 +1,33 @@
-from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional, FrozenSet, Deque, Set, Tuple, Iterator
 from enum import Enum
+from array import array
+from collections import OrderedDict, deque
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
 import time
 
 
+# журнал событий: запись в очередь, вывод в фоновом потоке
+logger = logging.getLogger(__name__)
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+
 # тип события в БД
 class EventType(Enum):
     INSERT = "INSERT"
@@ -11,83 +35,344 @@ class EventType(Enum):
     DELETE = "DELETE"
 
 
+# порядковый номер типа события для индексации массивов наблюдателей
+EVENT_TYPE_INDEX: Dict[EventType, int] = {event_type: i for i, event_type in enumerate(EventType)}
+
+
 # класс события БД
 class DatabaseEvent:
-    def __init__(self, event_type: EventType, table: str, data: Dict[str, Any]):
+    __slots__ = ('event_type', 'table', 'data', 'timestamp', '_type_idx', '_str', '_bytes')
+
+    # timestamp в наносекундах; если не задан, его проставит агрегатор при поступлении события
+    def __init__(self, event_type: EventType, table: str, data: Dict[str, Any],
+                 timestamp: Optional[int] = None):
         self.event_type = event_type
-        self.table = table
+        # интернированное имя таблицы: поиск в таблицах рассылки сравнивает указатели
+        self.table = sys.intern(table)
         self.data = data
-        self.timestamp = time.time()
+        self.timestamp = timestamp
+        self._type_idx = EVENT_TYPE_INDEX[event_type]
+        self._str = None
+        self._bytes = None
 
+    # строка формируется один раз, при первом обращении
     def __str__(self):
-        return f"{self.timestamp}: {self.event_type.value} on {self.table} - {self.data}"
+        if self._str is not None:
+            return self._str
+        text = f"{self.timestamp}: {self.event_type.value} on {self.table} - {self.data}"
+        # до проставления метки времени строку не кешируем
+        if self.timestamp is not None:
+            self._str = text
+        return text
 
+    # сериализация один раз на событие, байты общие для всех наблюдателей;
+    # JSON, а не pickle: разбор данных с реплики не может выполнить чужой код
+    def serialized(self) -> bytes:
+        if self._bytes is None:
+            self._bytes = json.dumps(
+                [self.event_type.value, self.table, self.data, self.timestamp],
+                ensure_ascii=False, separators=(',', ':'), default=str).encode()
+        return self._bytes
 
-# абстрактный класс наблюдателя
-class EventObserver(ABC):
-    @abstractmethod
-    def update(self, event: DatabaseEvent):
-        pass
+
+# наблюдатель - любой вызываемый объект, принимающий событие
+# (функция, лямбда или связанный метод, например audit_logger.update)
+EventHandler = Callable[[DatabaseEvent], None]
+
+
+def _notify_nobody(event: DatabaseEvent):
+    pass
+
+
+# генерирует функцию рассылки без цикла: по одному прямому вызову на обработчик,
+# обработчики передаются значениями по умолчанию и читаются как локальные переменные
+def _compile_notifier(callbacks: List[EventHandler]) -> EventHandler:
+    if not callbacks:
+        return _notify_nobody
+
+    params = ", ".join(f"_c{i}=_c{i}" for i in range(len(callbacks)))
+    body = "\n".join(f"    _c{i}(event)" for i in range(len(callbacks)))
+    namespace = {f"_c{i}": callback for i, callback in enumerate(callbacks)}
+    exec(f"def notifier(event, {params}):\n{body}\n", namespace)
+    return namespace["notifier"]
 
 
 # посредник для управления наблюдателями
 class EventMediator:
     def __init__(self):
-        self._observers: Dict[EventType, List[EventObserver]] = {
-            EventType.INSERT: [],
-            EventType.UPDATE: [],
-            EventType.DELETE: []
+        # реестр наблюдателей: у каждого подписанного обработчика свой целочисленный id,
+        # запись удаляется вместе с последней подпиской обработчика
+        self._registry_ids: Dict[EventHandler, int] = {}  # {handler: observer_id}
+        self._next_observer_id = 0
+
+        # подписки хранятся компактно: массив id наблюдателей на каждый тип события,
+        # индексируемый порядковым номером типа, а не хешем Enum
+        self._subscriber_ids: List[array] = [array('i') for _ in EventType]
+        # параллельно id: фильтр по таблицам (None - все таблицы) и сам обработчик
+        self._subscriber_tables: List[List[Optional[FrozenSet[str]]]] = [[] for _ in EventType]
+        self._subscriber_callbacks: List[List[EventHandler]] = [[] for _ in EventType]
+        # {observer_id: позиция в массивах подписок} для отписки за O(1)
+        self._positions: List[Dict[int, int]] = [{} for _ in EventType]
+        # число подписчиков на каждый тип события для быстрого выхода из notify
+        self._counts: List[int] = [0 for _ in EventType]
+
+        # таблицы рассылки, пересобираются перед первой рассылкой после подписки/отписки:
+        # _callbacks - наблюдатели без фильтра (для таблиц, не упомянутых ни в одном фильтре),
+        # _table_callbacks - {table: наблюдатели без фильтра + подписанные на эту таблицу}
+        self._callbacks: List[List[EventHandler]] = [[] for _ in EventType]
+        self._table_callbacks: List[Dict[str, List[EventHandler]]] = [{} for _ in EventType]
+        # скомпилированные по этим спискам функции рассылки
+        self._notifiers: List[EventHandler] = [_notify_nobody for _ in EventType]
+        self._table_notifiers: List[Dict[str, EventHandler]] = [{} for _ in EventType]
+        self._dirty: Set[int] = set()
+        # подписка может идти из другого потока, чем рассылка (async_dispatch):
+        # изменение массивов подписок и пересборка таблиц идут под блокировкой
+        self._lock = threading.Lock()
+
+    # связанные методы создаются заново при каждом обращении, но равны и хешируются
+    # по (объект, функция), поэтому реестр индексируется самим обработчиком
+    def _register(self, handler: EventHandler) -> int:
+        observer_id = self._registry_ids.get(handler)
+        if observer_id is None:
+            observer_id = self._registry_ids[handler] = self._next_observer_id
+            self._next_observer_id += 1
+        return observer_id
+
+    def _rebuild_dirty(self):
+        with self._lock:
+            for idx in self._dirty:
+                self._rebuild(idx)
+            self._dirty.clear()
+
+    def _rebuild(self, idx: int):
+        tables = self._subscriber_tables[idx]
+        callbacks = self._subscriber_callbacks[idx]
+
+        self._callbacks[idx] = [cb for cb, t in zip(callbacks, tables) if t is None]
+
+        filtered_tables = set()
+        for t in tables:
+            if t is not None:
+                filtered_tables.update(t)
+        self._table_callbacks[idx] = {
+            table: [cb for cb, t in zip(callbacks, tables) if t is None or table in t]
+            for table in filtered_tables
         }
 
-    def subscribe(self, event_type: EventType, observer: EventObserver):
-        self._observers[event_type].append(observer)
+        self._notifiers[idx] = _compile_notifier(self._callbacks[idx])
+        self._table_notifiers[idx] = {
+            table: _compile_notifier(table_callbacks)
+            for table, table_callbacks in self._table_callbacks[idx].items()
+        }
 
-    def unsubscribe(self, event_type: EventType, observer: EventObserver):
-        self._observers[event_type].remove(observer)
+    # tables - если задан, наблюдатель получает события только по этим таблицам
+    def subscribe(self, event_type: EventType, handler: EventHandler,
+                  tables: Optional[FrozenSet[str]] = None):
+        idx = EVENT_TYPE_INDEX[event_type]
+        with self._lock:
+            observer_id = self._register(handler)
+            positions = self._positions[idx]
+            if observer_id in positions:
+                raise ValueError("handler is already subscribed to this event type")
+
+            positions[observer_id] = len(self._subscriber_ids[idx])
+            self._subscriber_ids[idx].append(observer_id)
+            self._subscriber_tables[idx].append(
+                frozenset(sys.intern(t) for t in tables) if tables is not None else None)
+            self._subscriber_callbacks[idx].append(handler)
+            self._counts[idx] += 1
+            self._dirty.add(idx)
+
+    def unsubscribe(self, event_type: EventType, handler: EventHandler):
+        idx = EVENT_TYPE_INDEX[event_type]
+        with self._lock:
+            positions = self._positions[idx]
+            observer_id = self._registry_ids.get(handler, -1)
+            if observer_id not in positions:
+                raise ValueError("handler is not subscribed to this event type")
+
+            # меняем удаляемый элемент местами с последним и убираем хвост
+            index = positions.pop(observer_id)
+            for column in (self._subscriber_ids[idx], self._subscriber_tables[idx],
+                           self._subscriber_callbacks[idx]):
+                last = column.pop()
+                if index < len(column):
+                    column[index] = last
+            if index < len(self._subscriber_ids[idx]):
+                positions[self._subscriber_ids[idx][index]] = index
+            self._counts[idx] -= 1
+            self._dirty.add(idx)
+
+            # последняя подписка обработчика снята - реестр больше не держит ссылку на него
+            if not any(observer_id in other for other in self._positions):
+                del self._registry_ids[handler]
 
     def notify(self, event: DatabaseEvent):
-        for observer in self._observers[event.event_type]:
-            observer.update(event)
+        idx = event._type_idx
+        if not self._counts[idx]:
+            return
+        if self._dirty:
+            self._rebuild_dirty()
+        self._table_notifiers[idx].get(event.table, self._notifiers[idx])(event)
+
+    def notify_batch(self, events: List[DatabaseEvent]):
+        if self._dirty:
+            self._rebuild_dirty()
+        # раскладываем события по типам, чтобы выбирать таблицу рассылки один раз на тип
+        buckets: List[List[DatabaseEvent]] = [[] for _ in EventType]
+        for event in events:
+            buckets[event._type_idx].append(event)
+
+        for idx, bucket in enumerate(buckets):
+            if not bucket or not self._counts[idx]:
+                continue
+            notifier = self._notifiers[idx]
+            table_notifiers = self._table_notifiers[idx]
+            if not table_notifiers:
+                for event in bucket:
+                    notifier(event)
+            else:
+                for event in bucket:
+                    table_notifiers.get(event.table, notifier)(event)
 
 
 # агрегатор событий (имитация источника событий БД)
 class DatabaseEventAggregator:
-    def __init__(self):
+    # при async_dispatch=True наблюдатели вызываются в фоновом потоке,
+    # а add_event/add_events только кладут события в очередь и не ждут обработки;
+    # история хранит не более history_cap последних событий
+    def __init__(self, async_dispatch: bool = False, history_cap: int = 1_000_000):
         self.mediator = EventMediator()
-        self._event_history: List[DatabaseEvent] = []
+        self._event_history: Deque[DatabaseEvent] = deque(maxlen=history_cap)
+        # последние известные данные строк {(table, id): data} для отсева повторных UPDATE;
+        # как и история, хранит не более history_cap строк, давно не менявшиеся вытесняются
+        self._last_data: OrderedDict[Tuple[str, Any], Dict[str, Any]] = OrderedDict()
+        self._last_data_cap = history_cap
+        self._ingress: Optional[queue.SimpleQueue] = None
+        self._worker: Optional[threading.Thread] = None
+        if async_dispatch:
+            self._ingress = queue.SimpleQueue()
+            self._worker = threading.Thread(target=self._drain, daemon=True)
+            self._worker.start()
+
+    def _drain(self):
+        ingress = self._ingress
+        while True:
+            item = ingress.get()
+            if item is None:  # сигнал завершения
+                break
+            # ошибка наблюдателя не должна останавливать поток: иначе все
+            # следующие события так и останутся в очереди
+            try:
+                if isinstance(item, list):
+                    self.mediator.notify_batch(item)
+                else:
+                    self.mediator.notify(item)
+            except Exception:
+                logger.exception("Event handler failed")
+
+    # дождаться обработки уже поставленных в очередь событий и остановить поток
+    def close(self):
+        if self._worker is not None:
+            self._ingress.put(None)
+            self._worker.join()
+            self._worker = None
+            self._ingress = None
+
+    # UPDATE считается лишним, если данные строки совпадают с последними известными;
+    # сравниваются сами данные, а не их хеш, так что совпадение хешей не теряет изменений
+    def _is_redundant(self, event: DatabaseEvent) -> bool:
+        row_id = event.data.get('id')
+        if row_id is None:  # строку без id не отличить от других - не отсеиваем
+            return False
+        key = (event.table, row_id)
+        try:
+            if event.event_type is EventType.DELETE:
+                self._last_data.pop(key, None)
+                return False
+            previous = self._last_data.get(key)
+        except TypeError:  # нехешируемый id (например, список) - не отсеиваем
+            return False
+
+        redundant = event.event_type is EventType.UPDATE and previous == event.data
+        # копия: вызывающий код может изменить словарь события после отправки
+        self._last_data[key] = dict(event.data)
+        self._last_data.move_to_end(key)
+        if len(self._last_data) > self._last_data_cap:
+            self._last_data.popitem(last=False)
+        return redundant
 
     def add_event(self, event: DatabaseEvent):
-        print(f"New database event: {event}")
+        if event.timestamp is None:
+            event.timestamp = time.time_ns()
+        logger.info("New database event: %s", event)
         self._event_history.append(event)
-        self.mediator.notify(event)
+        if self._is_redundant(event):
+            return
+        if self._ingress is not None:
+            self._ingress.put(event)
+        else:
+            self.mediator.notify(event)
+
+    # пакетное добавление: одна операция extend и один проход по наблюдателям
+    def add_events(self, events: List[DatabaseEvent]):
+        # одна метка времени на весь пакет вместо вызова часов на каждое событие
+        timestamp = time.time_ns()
+        for event in events:
+            if event.timestamp is None:
+                event.timestamp = timestamp
+        logger.info("New database events: %d", len(events))
+        self._event_history.extend(events)
+        events = [event for event in events if not self._is_redundant(event)]
+        if self._ingress is not None:
+            self._ingress.put(events)
+        else:
+            self.mediator.notify_batch(events)
 
     def get_event_history(self):
-        return self._event_history.copy()
+        return list(self._event_history)
+
+    # просмотр истории без копирования; нельзя добавлять события во время обхода
+    def iter_event_history(self) -> Iterator[DatabaseEvent]:
+        return iter(self._event_history)
 
 
 # реализация наблюдателей
-class AuditLogger(EventObserver):
+class AuditLogger:
     def update(self, event: DatabaseEvent):
-        print(f"[Audit Log] {event}")
+        logger.info("[Audit Log] %s", event)
 
 
-class CacheInvalidator(EventObserver):
+class CacheInvalidator:
     def update(self, event: DatabaseEvent):
-        print(f"[Cache] Invalidating cache for {event.table} due to {event.event_type.value}")
+        logger.info("[Cache] Invalidating cache for %s due to %s", event.table, event.event_type.value)
 
 
-class ReplicationService(EventObserver):
+class ReplicationService:
     def update(self, event: DatabaseEvent):
-        print(f"[Replication] Replicating {event.event_type.value} operation to standby database")
+        payload = event.serialized()
+        logger.info("[Replication] Replicating %s operation to standby database (%d bytes)",
+                    event.event_type.value, len(payload))
 
 
-class AnalyticsService(EventObserver):
+class AnalyticsService:
+    # счётчики событий по типам: плоский массив int64, индекс - порядковый номер типа
+    def __init__(self):
+        self._counts = array('q', [0]) * len(EventType)
+
     def update(self, event: DatabaseEvent):
-        print(f"[Analytics] Processing {event.event_type.value} event for analytics")
+        self._counts[event._type_idx] += 1
+        logger.info("[Analytics] Processing %s event for analytics", event.event_type.value)
+
+    # сводка обработанных событий по типам
+    def counts(self) -> Dict[EventType, int]:
+        return {event_type: self._counts[idx] for event_type, idx in EVENT_TYPE_INDEX.items()}
 
 
 # пример использования
 if __name__ == "__main__":
+    log_listener = setup_logging()
+
     # создаем агрегатор событий
     aggregator = DatabaseEventAggregator()
 
@@ -99,18 +384,18 @@ if __name__ == "__main__":
 
     # подписываем наблюдателей на события
     mediator = aggregator.mediator
-    mediator.subscribe(EventType.INSERT, audit_logger)
-    mediator.subscribe(EventType.UPDATE, audit_logger)
-    mediator.subscribe(EventType.DELETE, audit_logger)
+    mediator.subscribe(EventType.INSERT, audit_logger.update)
+    mediator.subscribe(EventType.UPDATE, audit_logger.update)
+    mediator.subscribe(EventType.DELETE, audit_logger.update)
 
-    mediator.subscribe(EventType.UPDATE, cache_invalidator)
-    mediator.subscribe(EventType.DELETE, cache_invalidator)
+    mediator.subscribe(EventType.UPDATE, cache_invalidator.update)
+    mediator.subscribe(EventType.DELETE, cache_invalidator.update)
 
-    mediator.subscribe(EventType.INSERT, replication_service)
-    mediator.subscribe(EventType.UPDATE, replication_service)
-    mediator.subscribe(EventType.DELETE, replication_service)
+    mediator.subscribe(EventType.INSERT, replication_service.update)
+    mediator.subscribe(EventType.UPDATE, replication_service.update)
+    mediator.subscribe(EventType.DELETE, replication_service.update)
 
-    mediator.subscribe(EventType.INSERT, analytics_service)
+    mediator.subscribe(EventType.INSERT, analytics_service.update)
 
     # имитируем события БД
     aggregator.add_event(DatabaseEvent(
@@ -131,7 +416,14 @@ if __name__ == "__main__":
         {"id": 42, "name": "example_product"}
     ))
 
+    # дожидаемся вывода журнала перед печатью истории
+    log_listener.stop()
+
     # выводим историю событий
     print("\nEvent history:")
-    for event in aggregator.get_event_history():
-        print(event)
\ No newline at end of file
+    for event in aggregator.iter_event_history():
+        print(event)
+
+    print("\nAnalytics:")
+    for event_type, count in analytics_service.counts().items():
+        print(f"{event_type.value}: {count}")
\ No newline at end of file
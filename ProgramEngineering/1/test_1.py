@@ -0,0 +1,135 @@
+import importlib.util
+import json
+import os
+import threading
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_spec = importlib.util.spec_from_file_location("db_events", os.path.join(HERE, "1.py"))
+events = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(events)
+
+EventType = events.EventType
+DatabaseEvent = events.DatabaseEvent
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def update(self, event):
+        self.events.append(event)
+
+
+class EventMediatorTest(unittest.TestCase):
+    def test_notify_respects_table_filters(self):
+        mediator = events.EventMediator()
+        everything, users_only = Recorder(), Recorder()
+        mediator.subscribe(EventType.INSERT, everything.update)
+        mediator.subscribe(EventType.INSERT, users_only.update, frozenset({"users"}))
+
+        mediator.notify(DatabaseEvent(EventType.INSERT, "users", {"id": 1}))
+        mediator.notify(DatabaseEvent(EventType.INSERT, "orders", {"id": 2}))
+        mediator.notify_batch([DatabaseEvent(EventType.INSERT, "users", {"id": 3}),
+                               DatabaseEvent(EventType.UPDATE, "users", {"id": 3})])
+
+        self.assertEqual([e.data["id"] for e in everything.events], [1, 2, 3])
+        self.assertEqual([e.data["id"] for e in users_only.events], [1, 3])
+
+    def test_unsubscribe_releases_handler(self):
+        mediator = events.EventMediator()
+        first, second = Recorder(), Recorder()
+        mediator.subscribe(EventType.INSERT, first.update)
+        mediator.subscribe(EventType.UPDATE, first.update)
+        mediator.subscribe(EventType.INSERT, second.update)
+
+        mediator.unsubscribe(EventType.INSERT, first.update)
+        self.assertIn(first.update, mediator._registry_ids)
+        mediator.unsubscribe(EventType.UPDATE, first.update)
+        self.assertNotIn(first.update, mediator._registry_ids)
+
+        mediator.notify(DatabaseEvent(EventType.INSERT, "users", {"id": 1}))
+        self.assertEqual(first.events, [])
+        self.assertEqual(len(second.events), 1)
+        with self.assertRaises(ValueError):
+            mediator.unsubscribe(EventType.INSERT, first.update)
+
+
+class DatabaseEventAggregatorTest(unittest.TestCase):
+    def updates(self, aggregator, payloads):
+        recorder = Recorder()
+        aggregator.mediator.subscribe(EventType.UPDATE, recorder.update)
+        for data in payloads:
+            aggregator.add_event(DatabaseEvent(EventType.UPDATE, "users", data))
+        return [e.data for e in recorder.events]
+
+    def test_repeated_update_is_dropped(self):
+        payloads = [{"id": 1, "name": "a"}, {"id": 1, "name": "a"}, {"id": 1, "name": "b"}]
+        self.assertEqual(self.updates(events.DatabaseEventAggregator(), payloads),
+                         [payloads[0], payloads[2]])
+
+    def test_rows_without_id_are_not_deduplicated(self):
+        payloads = [{"name": "a"}, {"name": "b"}, {"name": "b"}]
+        self.assertEqual(self.updates(events.DatabaseEventAggregator(), payloads), payloads)
+
+    def test_unhashable_payloads_are_compared(self):
+        payloads = [{"id": 1, "tags": ["x"]}, {"id": 1, "tags": ["x"]}, {"id": 1, "tags": ["y"]}]
+        self.assertEqual(self.updates(events.DatabaseEventAggregator(), payloads),
+                         [payloads[0], payloads[2]])
+
+    def test_last_data_is_bounded(self):
+        aggregator = events.DatabaseEventAggregator(history_cap=2)
+        payloads = [{"id": 1}, {"id": 2}, {"id": 3}, {"id": 1}, {"id": 3}]
+        # строка 1 вытеснена строками 2 и 3, поэтому её повтор не распознаётся
+        self.assertEqual(self.updates(aggregator, payloads), payloads[:4])
+        self.assertEqual(len(aggregator._last_data), 2)
+
+    def test_unhashable_id_is_not_deduplicated(self):
+        payloads = [{"id": [1]}, {"id": [1]}]
+        self.assertEqual(self.updates(events.DatabaseEventAggregator(), payloads), payloads)
+
+    def test_async_dispatch_survives_handler_errors_and_concurrent_subscribe(self):
+        aggregator = events.DatabaseEventAggregator(async_dispatch=True)
+        recorder = Recorder()
+
+        def failing(event):
+            raise RuntimeError("handler failure")
+
+        # recorder вызывается раньше падающего обработчика и видит каждое событие
+        aggregator.mediator.subscribe(EventType.INSERT, recorder.update)
+        aggregator.mediator.subscribe(EventType.INSERT, failing)
+        late = [Recorder() for _ in range(200)]
+
+        def subscribe_late():
+            for observer in late:
+                aggregator.mediator.subscribe(EventType.INSERT, observer.update)
+            for observer in late[::2]:
+                aggregator.mediator.unsubscribe(EventType.INSERT, observer.update)
+
+        with self.assertLogs(events.logger, level="ERROR"):
+            thread = threading.Thread(target=subscribe_late)
+            thread.start()
+            for i in range(2000):
+                aggregator.add_event(DatabaseEvent(EventType.INSERT, "users", {"id": i}))
+            thread.join()
+            aggregator.close()
+
+        self.assertEqual([e.data["id"] for e in recorder.events], list(range(2000)))
+
+    def test_serialized_payload_is_json(self):
+        event = DatabaseEvent(EventType.DELETE, "products", {"id": 42}, timestamp=7)
+        self.assertEqual(json.loads(event.serialized()), ["DELETE", "products", {"id": 42}, 7])
+
+
+class AnalyticsServiceTest(unittest.TestCase):
+    def test_counts_by_event_type(self):
+        analytics = events.AnalyticsService()
+        for event_type in (EventType.INSERT, EventType.INSERT, EventType.DELETE):
+            analytics.update(DatabaseEvent(event_type, "users", {"id": 1}))
+        self.assertEqual(analytics.counts(),
+                         {EventType.INSERT: 2, EventType.UPDATE: 0, EventType.DELETE: 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,81 @@
 import sys
 from datetime import *
+import io
 import json
 import math
+import mmap
+import os
+import tempfile
+import time
+import re
+import heapq
+from array import array
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Tuple, Set
+from contextlib import contextmanager
+from functools import lru_cache
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Deque
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                             QLabel, QLineEdit, QPushButton, QListWidget, QMessageBox,
+                             QLabel, QLineEdit, QPushButton, QListWidget, QListView, QMessageBox,
                              QSpinBox, QComboBox, QAction, QFileDialog, QGraphicsView,
                              QGraphicsScene, QGraphicsEllipseItem, QGraphicsTextItem,
-                             QGraphicsLineItem, QGraphicsItem)
-from PyQt5.QtCore import Qt, QPointF
-from PyQt5.QtGui import QColor, QPen, QPainter
+                             QGraphicsPathItem)
+from PyQt5.QtCore import Qt, QPointF, QSignalBlocker, QTimer, QStringListModel
+from PyQt5.QtGui import QColor, QPen, QPainter, QPainterPath
 import traceback
-import sys
-from PyQt5.QtCore import QObject, pyqtSlot
+
+try:
+    import orjson  # необязательная зависимость: быстрая (де)сериализация JSON
+except ImportError:
+    orjson = None
+
+
+def _orjson_indented(value, indent: bytes) -> bytes:
+    """JSON значения с отступами, сдвинутый под уровень вложенности indent"""
+    # orjson отступает от нулевой колонки; переводы строк внутри строк JSON
+    # экранированы, поэтому сдвинуть значение можно простой заменой
+    return orjson.dumps(value, option=orjson.OPT_INDENT_2).replace(b'\n', indent)
+
+
+def json_dump(data: dict, f) -> None:
+    """Записать словарь в JSON (UTF-8, с отступами) в двоичный файл f"""
+    if orjson is not None:
+        # orjson собирает весь документ в одном буфере, поэтому он получает
+        # по одному разделу, а списки (журналы команд) - по одному элементу
+        f.write(b'{')
+        for i, (key, value) in enumerate(data.items()):
+            f.write(b',\n  ' if i else b'\n  ')
+            f.write(orjson.dumps(key) + b': ')
+            if isinstance(value, list) and value:
+                f.write(b'[')
+                for j, item in enumerate(value):
+                    f.write(b',\n    ' if j else b'\n    ')
+                    f.write(_orjson_indented(item, b'\n    '))
+                f.write(b'\n  ]')
+            else:
+                f.write(_orjson_indented(value, b'\n  '))
+        f.write(b'\n}' if data else b'}')
+        return
+    # json.dump пишет по частям, без промежуточной строки со всем документом
+    writer = io.TextIOWrapper(f, encoding='utf-8')
+    json.dump(data, writer, indent=2, ensure_ascii=False)
+    writer.detach()
+
+
+def json_load(f):
+    """Прочитать JSON из двоичного файла f"""
+    if orjson is not None:
+        # orjson разбирает отображённый в память файл без копирования в bytes
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+    return json.load(f)
+
+
+def json_loads(raw):
+    """Разобрать JSON из bytes или str"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
 
 def exception_hook(exctype, value, tb):
@@ -28,17 +90,49 @@ sys.excepthook = exception_hook
 
 
 # region Модель данных
+def road_cost(value) -> int:
+    """Стоимость дороги из файла: целое число (3.0 тоже допускается), иначе ValueError"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    raise ValueError(f"Invalid road cost: {value!r}")
+
+
 class CityMap:
     """Класс для хранения карты городов и дорог с поддержкой множественных дорог"""
 
     def __init__(self):
-        self.cities: Dict[str, Dict[str, List[int]]] = {}  # {city: {neighbor: [cost1, cost2]}}
+        # {city: {neighbor: {edge_id: cost}}}, словарь дорог пары городов общий для обоих направлений
+        self.cities: Dict[str, Dict[str, Dict[int, int]]] = {}
+        self._next_edge_id = 0
+
+        # номер версии карты, растёт при каждом изменении
+        self.version = 0
+        # производные представления, действительны до следующего изменения;
+        # возвращаемые из кеша списки нельзя изменять
+        self._csr: Optional[Tuple[List[str], array, array, array]] = None
+        self._city_names: Optional[List[str]] = None
+        self._all_roads: Optional[List[Tuple[str, str, List[int]]]] = None
+        self._all_road_edges: Optional[List[Tuple[str, str, List[Tuple[int, int]]]]] = None
+        self._roads_from_city: Dict[str, List[Tuple[str, List[int]]]] = {}
+
+    def _invalidate(self):
+        """Сбросить производные представления после изменения карты"""
+        self.version += 1
+        self._csr = None
+        self._city_names = None
+        self._all_roads = None
+        self._all_road_edges = None
+        self._roads_from_city = {}
 
     def add_city(self, name: str) -> bool:
         """Добавить город с уникальным именем"""
         if name in self.cities:
             return False
-        self.cities[name] = {}
+        # все равные имена указывают на один объект строки: сравнение ключей по ссылке
+        self.cities[sys.intern(name)] = {}
+        self._invalidate()
         return True
 
     def remove_city(self, name: str) -> bool:
@@ -46,11 +140,26 @@ class CityMap:
         if name not in self.cities:
             return False
 
-        for city in self.cities:
-            if name in self.cities[city]:
-                del self.cities[city][name]
+        # дороги симметричны: обратные ссылки есть только у соседей
+        for neighbor in self.cities[name]:
+            if neighbor != name:
+                del self.cities[neighbor][name]
 
         del self.cities[name]
+        self._invalidate()
+        return True
+
+    def restore_city(self, name: str, roads: Dict[str, Dict[int, int]]) -> bool:
+        """Вернуть удалённый город вместе с его словарём дорог (как был до удаления)"""
+        if name in self.cities or any(neighbor != name and neighbor not in self.cities
+                                      for neighbor in roads):
+            return False
+
+        # словари рёбер общие для обоих направлений: достаточно вернуть ссылки
+        self.cities[name] = roads
+        for neighbor, edges in roads.items():
+            self.cities[neighbor][name] = edges
+        self._invalidate()
         return True
 
     def rename_city(self, old_name: str, new_name: str) -> bool:
@@ -59,13 +168,15 @@ class CityMap:
             return False
 
         # переносим все дороги
+        new_name = sys.intern(new_name)
         self.cities[new_name] = self.cities.pop(old_name)
 
-        # обновляем ссылки в других городах
-        for city in self.cities:
-            if old_name in self.cities[city]:
-                self.cities[city][new_name] = self.cities[city].pop(old_name)
+        # обновляем ссылки у соседей (список копируется: ключи могут меняться у самого города)
+        for neighbor in list(self.cities[new_name]):
+            neighbor_roads = self.cities[new_name if neighbor == old_name else neighbor]
+            neighbor_roads[new_name] = neighbor_roads.pop(old_name)
 
+        self._invalidate()
         return True
 
     def add_road(self, city1: str, city2: str, cost: int) -> bool:
@@ -73,14 +184,22 @@ class CityMap:
         if city1 not in self.cities or city2 not in self.cities:
             return False
 
-        if city2 not in self.cities[city1]:
-            self.cities[city1][city2] = []
-            self.cities[city2][city1] = []
+        edges = self.cities[city1].get(city2)
+        if edges is None:
+            edges = self.cities[city1][city2] = self.cities[city2][city1] = {}
 
-        self.cities[city1][city2].append(cost)
-        self.cities[city2][city1].append(cost)
+        edges[self._next_edge_id] = cost
+        self._next_edge_id += 1
+        self._invalidate()
         return True
 
+    def _find_edge(self, city1: str, city2: str, cost: int) -> Optional[int]:
+        """Найти id первой дороги между городами с указанной стоимостью"""
+        for edge_id, edge_cost in self.cities[city1][city2].items():
+            if edge_cost == cost:
+                return edge_id
+        return None
+
     def remove_road(self, city1: str, city2: str, cost: Optional[int] = None) -> bool:
         """Удалить дорогу между городами"""
         if city1 not in self.cities or city2 not in self.cities:
@@ -91,54 +210,151 @@ class CityMap:
         if cost is None:
             # удаляем все дороги между городами
             del self.cities[city1][city2]
-            del self.cities[city2][city1]
-        else:
-            # удаляем только дорогу с указанной стоимостью
-            if cost in self.cities[city1][city2]:
-                self.cities[city1][city2].remove(cost)
-                self.cities[city2][city1].remove(cost)
-                if not self.cities[city1][city2]:
-                    del self.cities[city1][city2]
-                    del self.cities[city2][city1]
+            self.cities[city2].pop(city1, None)
+            self._invalidate()
+            return True
+
+        # удаляем только дорогу с указанной стоимостью; если такой нет, удалять нечего,
+        # и команда не должна попасть в журнал (её отмена добавила бы лишнюю дорогу)
+        edge_id = self._find_edge(city1, city2, cost)
+        if edge_id is None:
+            return False
+        return self.remove_road_by_id(city1, city2, edge_id)
+
+    def remove_road_by_id(self, city1: str, city2: str, edge_id: int) -> bool:
+        """Удалить конкретную дорогу по её id"""
+        edges = self.cities.get(city1, {}).get(city2)
+        if edges is None or edge_id not in edges:
+            return False
 
+        del edges[edge_id]
+        if not edges:
+            del self.cities[city1][city2]
+            self.cities[city2].pop(city1, None)
+        self._invalidate()
         return True
 
     def update_road_cost(self, city1: str, city2: str, old_cost: int, new_cost: int) -> bool:
         """Изменить стоимость конкретной дороги между городами"""
         if city1 not in self.cities or city2 not in self.cities:
             return False
-        if city2 not in self.cities[city1] or old_cost not in self.cities[city1][city2]:
+        if city2 not in self.cities[city1]:
+            return False
+
+        edge_id = self._find_edge(city1, city2, old_cost)
+        if edge_id is None:
+            return False
+        return self.update_road_by_id(city1, city2, edge_id, new_cost)
+
+    def update_road_by_id(self, city1: str, city2: str, edge_id: int, new_cost: int) -> bool:
+        """Изменить стоимость конкретной дороги по её id"""
+        edges = self.cities.get(city1, {}).get(city2)
+        if edges is None or edge_id not in edges:
             return False
 
-        index = self.cities[city1][city2].index(old_cost)
-        self.cities[city1][city2][index] = new_cost
-        self.cities[city2][city1][index] = new_cost
+        edges[edge_id] = new_cost
+        self._invalidate()
         return True
 
     def get_cities(self) -> List[str]:
         """Получить список всех городов"""
-        return list(self.cities.keys())
+        if self._city_names is None:
+            self._city_names = list(self.cities)
+        return self._city_names
 
     def get_roads_from_city(self, city: str) -> List[Tuple[str, List[int]]]:
         """Получить список дорог из города с их стоимостями"""
         if city not in self.cities:
             return []
-        return list(self.cities[city].items())
+        roads = self._roads_from_city.get(city)
+        if roads is None:
+            roads = self._roads_from_city[city] = [
+                (neighbor, list(edges.values())) for neighbor, edges in self.cities[city].items()
+            ]
+        return roads
 
     def get_all_roads(self) -> List[Tuple[str, str, List[int]]]:
-        """Получить список всех дорог"""
-        roads = set()
-        for city1 in self.cities:
-            for city2 in self.cities[city1]:
-                # Чтобы не дублировать дороги (A-B и B-A)
-                if (city2, city1) not in roads:
-                    roads.add((city1, city2))
-        return [(city1, city2, self.cities[city1][city2]) for city1, city2 in roads]
+        """Получить все дороги, каждую пару городов - один раз"""
+        if self._all_roads is None:
+            self._all_roads = [(city1, city2, [cost for _, cost in edges])
+                               for city1, city2, edges in self.get_all_road_edges()]
+        return self._all_roads
+
+    def get_all_road_edges(self) -> List[Tuple[str, str, List[Tuple[int, int]]]]:
+        """Получить все дороги с их id: (city1, city2, [(edge_id, cost), ...])"""
+        if self._all_road_edges is None:
+            # чтобы не дублировать дороги (A-B и B-A), берём пару в каноническом порядке
+            self._all_road_edges = [
+                (city1, city2, list(edges.items()))
+                for city1, neighbors in self.cities.items()
+                for city2, edges in neighbors.items()
+                if city1 <= city2
+            ]
+        return self._all_road_edges
+
+    def to_csr(self) -> Tuple[List[str], array, array, array]:
+        """Компактное представление CSR: (names, indptr, indices, costs).
+        Дороги города names[i] - это indices[indptr[i]:indptr[i + 1]] (номера соседей)
+        и costs в тех же позициях; каждая параллельная дорога - отдельная запись"""
+        if self._csr is None:
+            names = list(self.cities)
+            ids = {name: i for i, name in enumerate(names)}
+            indptr = array('i', [0])
+            indices = array('i')
+            costs = array('i')
+            for name in names:
+                for neighbor, edges in self.cities[name].items():
+                    neighbor_id = ids[neighbor]
+                    for cost in edges.values():
+                        indices.append(neighbor_id)
+                        costs.append(cost)
+                indptr.append(len(indices))
+            self._csr = (names, indptr, indices, costs)
+        return self._csr
+
+    def shortest_path(self, source: str, target: str) -> Optional[Tuple[int, List[str]]]:
+        """Кратчайший путь (Дейкстра по CSR): (стоимость, [города]) или None, если пути нет"""
+        if source not in self.cities or target not in self.cities:
+            return None
+
+        names, indptr, indices, costs = self.to_csr()
+        ids = {name: i for i, name in enumerate(names)}
+        start, finish = ids[source], ids[target]
+
+        inf = float('inf')
+        dist = [inf] * len(names)
+        prev = array('i', [-1]) * len(names)
+        dist[start] = 0
+        heap = [(0, start)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node == finish:
+                break
+            if d > dist[node]:
+                continue
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[k]
+                nd = d + costs[k]
+                if nd < dist[neighbor]:
+                    dist[neighbor] = nd
+                    prev[neighbor] = node
+                    heapq.heappush(heap, (nd, neighbor))
+
+        if dist[finish] == inf:
+            return None
+
+        path = [finish]
+        while path[-1] != start:
+            path.append(prev[path[-1]])
+        return dist[finish], [names[i] for i in reversed(path)]
 
     def to_dict(self) -> dict:
         """Улучшенная сериализация с поддержкой множественных дорог"""
         return {
-            'cities': self.cities,
+            'cities': {
+                city: {neighbor: list(edges.values()) for neighbor, edges in neighbors.items()}
+                for city, neighbors in self.cities.items()
+            },
             '_serializer': 'CityMap_v2'  # версия формата
         }
 
@@ -150,37 +366,38 @@ class CityMap:
         version = data.get('_version', '1.0')
 
         if version == '1.2':
-            self.cities = {}
             cities_data = data.get('cities', {})
-            for city, neighbors in cities_data.items():
-                self.cities[city] = {}
-                for neighbor, costs in neighbors.items():
-                    self.cities[city][neighbor] = list(costs) if isinstance(costs, list) else [costs]
         else:
-            self.cities = {}
-            for city, neighbors in data.items():
-                self.cities[city] = {}
-                if isinstance(neighbors, dict):
-                    for neighbor, costs in neighbors.items():
-                        self.cities[city][neighbor] = list(costs) if isinstance(costs, list) else [costs]
+            cities_data = {city: neighbors for city, neighbors in data.items()
+                           if isinstance(neighbors, dict)}
+
+        self.cities = {sys.intern(city): {} for city in cities_data}
+        self._next_edge_id = 0
+        self._invalidate()
+        for city, neighbors in cities_data.items():
+            city = sys.intern(city)
+            for neighbor, costs in neighbors.items():
+                neighbor = sys.intern(neighbor)
+                # обратное направление той же пары уже загружено
+                if neighbor not in self.cities or city in self.cities[neighbor]:
+                    continue
+                for cost in (costs if isinstance(costs, list) else [costs]):
+                    self.add_road(city, neighbor, road_cost(cost))
+
+    def adopt(self, other: 'CityMap'):
+        """Забрать дороги и города другой карты (other после этого не используется)"""
+        self.cities = other.cities
+        self._next_edge_id = other._next_edge_id
+        self._invalidate()
 
 # endregion
 
 # region Паттерны
-class Memento:
-    """Хранитель для сохранения состояния карты"""
-
-    def __init__(self, state: dict):
-        self.state = state
-
-    def get_state(self) -> dict:
-        """Получить сохраненное состояние"""
-        return self.state
-
-
 class Command(ABC):
     """Абстрактный класс команды"""
 
+    __slots__ = ()
+
     @abstractmethod
     def execute(self) -> bool:
         pass
@@ -191,11 +408,11 @@ class Command(ABC):
 
 
 class AddCityCommand(Command):
+    __slots__ = ('city_map', 'name')
+
     def __init__(self, city_map: CityMap, name: str):
         self.city_map = city_map
-        self.name = name
-        # Для сериализации
-        self._type = 'AddCityCommand'
+        self.name = sys.intern(name)
 
     def execute(self) -> bool:
         result = self.city_map.add_city(self.name)
@@ -204,30 +421,33 @@ class AddCityCommand(Command):
     def undo(self) -> bool:
         return self.city_map.remove_city(self.name)
 
-    @property
-    def __dict__(self):
-        return {
-            'type': self._type,
-            'name': self.name
-        }
-
 
 class RemoveCityCommand(Command):
+    __slots__ = ('city_map', 'name', 'roads', '_removed')
+
     def __init__(self, city_map: CityMap, name: str):
         self.city_map = city_map
-        self.name = name
+        self.name = sys.intern(name)
         self.roads = []
-        self._type = 'RemoveCityCommand'
+        # словарь дорог удалённого города (снимок для отмены без повторного add_road)
+        self._removed: Optional[Dict[str, Dict[int, int]]] = None
 
     def execute(self) -> bool:
         if self.name not in self.city_map.cities:
             return False
 
-        for neighbor, costs in self.city_map.cities[self.name].items():
-            self.roads.append((self.name, neighbor, costs.copy()))
+        self._removed = self.city_map.cities[self.name]
+        # стоимости храним кортежами: они неизменяемы и компактнее списков
+        self.roads = [(self.name, neighbor, tuple(edges.values()))
+                      for neighbor, edges in self._removed.items()]
         return self.city_map.remove_city(self.name)
 
     def undo(self) -> bool:
+        if self._removed is not None:
+            removed, self._removed = self._removed, None
+            return self.city_map.restore_city(self.name, removed)
+
+        # команда загружена из файла без выполнения: восстанавливаем по списку дорог
         if not self.city_map.add_city(self.name):
             return False
 
@@ -236,21 +456,14 @@ class RemoveCityCommand(Command):
                 self.city_map.add_road(city1, city2, cost)
         return True
 
-    @property
-    def __dict__(self):
-        return {
-            'type': self._type,
-            'name': self.name,
-            'roads': self.roads
-        }
-
 
 class RenameCityCommand(Command):
+    __slots__ = ('city_map', 'old_name', 'new_name')
+
     def __init__(self, city_map: CityMap, old_name: str, new_name: str):
         self.city_map = city_map
-        self.old_name = old_name
-        self.new_name = new_name
-        self._type = 'RenameCityCommand'
+        self.old_name = sys.intern(old_name)
+        self.new_name = sys.intern(new_name)
 
     def execute(self) -> bool:
         return self.city_map.rename_city(self.old_name, self.new_name)
@@ -258,22 +471,15 @@ class RenameCityCommand(Command):
     def undo(self) -> bool:
         return self.city_map.rename_city(self.new_name, self.old_name)
 
-    @property
-    def __dict__(self):
-        return {
-            'type': self._type,
-            'old_name': self.old_name,
-            'new_name': self.new_name
-        }
-
 
 class AddRoadCommand(Command):
+    __slots__ = ('city_map', 'city1', 'city2', 'cost')
+
     def __init__(self, city_map: CityMap, city1: str, city2: str, cost: int):
         self.city_map = city_map
-        self.city1 = city1
-        self.city2 = city2
+        self.city1 = sys.intern(city1)
+        self.city2 = sys.intern(city2)
         self.cost = cost
-        self._type = 'AddRoadCommand'
 
     def execute(self) -> bool:
         return self.city_map.add_road(self.city1, self.city2, self.cost)
@@ -281,23 +487,15 @@ class AddRoadCommand(Command):
     def undo(self) -> bool:
         return self.city_map.remove_road(self.city1, self.city2, self.cost)
 
-    @property
-    def __dict__(self):
-        return {
-            'type': self._type,
-            'city1': self.city1,
-            'city2': self.city2,
-            'cost': self.cost
-        }
-
 
 class RemoveRoadCommand(Command):
+    __slots__ = ('city_map', 'city1', 'city2', 'cost')
+
     def __init__(self, city_map: CityMap, city1: str, city2: str, cost: int):
         self.city_map = city_map
-        self.city1 = city1
-        self.city2 = city2
+        self.city1 = sys.intern(city1)
+        self.city2 = sys.intern(city2)
         self.cost = cost
-        self._type = 'RemoveRoadCommand'
 
     def execute(self) -> bool:
         return self.city_map.remove_road(self.city1, self.city2, self.cost)
@@ -305,24 +503,16 @@ class RemoveRoadCommand(Command):
     def undo(self) -> bool:
         return self.city_map.add_road(self.city1, self.city2, self.cost)
 
-    @property
-    def __dict__(self):
-        return {
-            'type': self._type,
-            'city1': self.city1,
-            'city2': self.city2,
-            'cost': self.cost
-        }
-
 
 class UpdateRoadCommand(Command):
+    __slots__ = ('city_map', 'city1', 'city2', 'old_cost', 'new_cost')
+
     def __init__(self, city_map: CityMap, city1: str, city2: str, old_cost: int, new_cost: int):
         self.city_map = city_map
-        self.city1 = city1
-        self.city2 = city2
+        self.city1 = sys.intern(city1)
+        self.city2 = sys.intern(city2)
         self.old_cost = old_cost
         self.new_cost = new_cost
-        self._type = 'UpdateRoadCommand'
 
     def execute(self) -> bool:
         return self.city_map.update_road_cost(self.city1, self.city2, self.old_cost, self.new_cost)
@@ -330,118 +520,144 @@ class UpdateRoadCommand(Command):
     def undo(self) -> bool:
         return self.city_map.update_road_cost(self.city1, self.city2, self.new_cost, self.old_cost)
 
-    @property
-    def __dict__(self):
-        return {
-            'type': self._type,
-            'city1': self.city1,
-            'city2': self.city2,
-            'old_cost': self.old_cost,
-            'new_cost': self.new_cost
-        }
+
+def _remove_city_from_dict(city_map: CityMap, data: dict) -> RemoveCityCommand:
+    cmd = RemoveCityCommand(city_map, data['name'])
+    cmd.roads = [(sys.intern(city1), sys.intern(city2), tuple(costs))
+                 for city1, city2, costs in data.get('roads', [])]
+    return cmd
+
+
+# таблицы (де)сериализации команд: выбор по типу за один поиск в словаре
+COMMAND_SERIALIZERS = {
+    AddCityCommand: lambda c: {'type': 'AddCityCommand', 'name': c.name},
+    RemoveCityCommand: lambda c: {'type': 'RemoveCityCommand', 'name': c.name, 'roads': c.roads},
+    RenameCityCommand: lambda c: {'type': 'RenameCityCommand', 'old_name': c.old_name,
+                                  'new_name': c.new_name},
+    AddRoadCommand: lambda c: {'type': 'AddRoadCommand', 'city1': c.city1, 'city2': c.city2,
+                               'cost': c.cost},
+    RemoveRoadCommand: lambda c: {'type': 'RemoveRoadCommand', 'city1': c.city1, 'city2': c.city2,
+                                  'cost': c.cost},
+    UpdateRoadCommand: lambda c: {'type': 'UpdateRoadCommand', 'city1': c.city1, 'city2': c.city2,
+                                  'old_cost': c.old_cost, 'new_cost': c.new_cost},
+}
+
+COMMAND_DESERIALIZERS = {
+    'AddCityCommand': lambda m, d: AddCityCommand(m, d['name']),
+    'RemoveCityCommand': _remove_city_from_dict,
+    'RenameCityCommand': lambda m, d: RenameCityCommand(m, d['old_name'], d['new_name']),
+    'AddRoadCommand': lambda m, d: AddRoadCommand(m, d['city1'], d['city2'], road_cost(d['cost'])),
+    'RemoveRoadCommand': lambda m, d: RemoveRoadCommand(m, d['city1'], d['city2'],
+                                                        road_cost(d['cost'])),
+    'UpdateRoadCommand': lambda m, d: UpdateRoadCommand(m, d['city1'], d['city2'],
+                                                        road_cost(d['old_cost']),
+                                                        road_cost(d['new_cost'])),
+}
 
 
 class CommandManager:
-    def __init__(self, city_map: CityMap):
-        self.city_map = city_map
-        self.undo_stack = []
-        self.redo_stack = []
-        self.history = []
-        self.current_history_index = -1
-        self._save_state()
-
-    def _save_state(self):
-        """Сохраняет текущее состояние в историю"""
-        state = {
-            'map_state': self._get_safe_state(),
-            'undo_stack': self._serialize_commands(self.undo_stack),
-            'redo_stack': self._serialize_commands(self.redo_stack)
-        }
+    """Журнал команд: хранит только начальное состояние карты и стеки команд,
+    текущее состояние получается повтором команд из undo_stack.
 
-        if self.current_history_index < len(self.history) - 1:
-            self.history = self.history[:self.current_history_index + 1]
+    Стеки ограничены MAX_HISTORY командами: самая старая команда, вытесняемая
+    из undo_stack, применяется к базовой карте, от которой отсчитывается журнал.
+    """
 
-        self.history.append(state)
-        self.current_history_index = len(self.history) - 1
+    MAX_HISTORY = 256
+    # правки стоимости одной дороги, сделанные быстрее, чем за COALESCE_WINDOW
+    # секунд одна после другой, сливаются в одну команду
+    COALESCE_WINDOW = 0.5
 
-    def _get_safe_state(self):
+    def __init__(self, city_map: CityMap):
+        self.city_map = city_map
+        self.undo_stack: Deque[Command] = deque()
+        self.redo_stack: Deque[Command] = deque(maxlen=self.MAX_HISTORY)
+        self.initial_state = self._get_safe_state()
+        # карта в начальном состоянии, создаётся при первом вытеснении команды
+        self._base_map: Optional[CityMap] = None
+        # время последнего выполнения команды (time.monotonic)
+        self._last_execute = float('-inf')
+
+    def _get_safe_state(self, city_map: Optional[CityMap] = None):
         """Гарантирует правильный формат данных"""
+        city_map = city_map or self.city_map
         return {
             'cities': {
                 str(city): {
-                    str(neighbor): list(costs)
-                    for neighbor, costs in roads.items()
+                    str(neighbor): list(edges.values())
+                    for neighbor, edges in roads.items()
                 }
-                for city, roads in self.city_map.cities.items()
+                for city, roads in city_map.cities.items()
             },
             '_version': '1.2'
         }
 
+    def _push_undo(self, command: Command):
+        """Положить команду в undo_stack, вытеснив самую старую при переполнении"""
+        if len(self.undo_stack) == self.MAX_HISTORY:
+            self._fold_into_base(self.undo_stack.popleft())
+        self.undo_stack.append(command)
+
+    def _fold_into_base(self, command: Command):
+        """Применить вытесненную команду к начальному состоянию журнала"""
+        if self._base_map is None:
+            self._base_map = CityMap()
+            self._base_map.from_dict(self.initial_state)
+        # команда привязана к текущей карте, для базовой создаётся её копия
+        data = self._command_to_dict(command)
+        COMMAND_DESERIALIZERS[data['type']](self._base_map, data).execute()
+
+    def _initial_state(self):
+        """Начальное состояние журнала с учётом вытесненных команд"""
+        if self._base_map is None:
+            return self.initial_state
+        return self._get_safe_state(self._base_map)
+
     def _serialize_commands(self, commands):
         """Сериализация всех типов команд"""
         return [self._command_to_dict(cmd) for cmd in commands]
 
     def _command_to_dict(self, cmd):
         """Преобразование команды в словарь"""
-        if isinstance(cmd, AddCityCommand):
-            return {
-                'type': 'AddCityCommand',
-                'name': cmd.name
-            }
-        elif isinstance(cmd, RemoveCityCommand):
-            return {
-                'type': 'RemoveCityCommand',
-                'name': cmd.name,
-                'roads': cmd.roads
-            }
-        elif isinstance(cmd, RenameCityCommand):
-            return {
-                'type': 'RenameCityCommand',
-                'old_name': cmd.old_name,
-                'new_name': cmd.new_name
-            }
-        elif isinstance(cmd, AddRoadCommand):
-            return {
-                'type': 'AddRoadCommand',
-                'city1': cmd.city1,
-                'city2': cmd.city2,
-                'cost': cmd.cost
-            }
-        elif isinstance(cmd, RemoveRoadCommand):
-            return {
-                'type': 'RemoveRoadCommand',
-                'city1': cmd.city1,
-                'city2': cmd.city2,
-                'cost': cmd.cost
-            }
-        elif isinstance(cmd, UpdateRoadCommand):
-            return {
-                'type': 'UpdateRoadCommand',
-                'city1': cmd.city1,
-                'city2': cmd.city2,
-                'old_cost': cmd.old_cost,
-                'new_cost': cmd.new_cost
-            }
-        return {}
+        serializer = COMMAND_SERIALIZERS.get(type(cmd))
+        return serializer(cmd) if serializer else {}
 
     def execute_command(self, command: Command) -> bool:
-        """Выполняет команду с сохранением в историю"""
+        """Выполняет команду и добавляет её в журнал"""
         if command.execute():
-            self.undo_stack.append(command)
+            now = time.monotonic()
+            if not self._coalesce(command, now):
+                self._push_undo(command)
+            self._last_execute = now
             self.redo_stack.clear()
-            self._save_state()
             return True
         return False
 
+    def _coalesce(self, command: Command, now: float) -> bool:
+        """Слить правку стоимости с непосредственно предшествующей правкой той же дороги"""
+        if (not isinstance(command, UpdateRoadCommand) or not self.undo_stack
+                or now - self._last_execute > self.COALESCE_WINDOW):
+            return False
+
+        top = self.undo_stack[-1]
+        if not (isinstance(top, UpdateRoadCommand) and top.new_cost == command.old_cost
+                and {top.city1, top.city2} == {command.city1, command.city2}):
+            return False
+
+        top.new_cost = command.new_cost
+        if top.old_cost == top.new_cost:
+            self.undo_stack.pop()  # правки взаимно погасились
+        return True
+
     def undo(self) -> bool:
         """Отмена последней команды"""
         if not self.undo_stack:
             return False
 
+        self._last_execute = float('-inf')
         command = self.undo_stack.pop()
         if command.undo():
             self.redo_stack.append(command)
-            self._save_state()
             return True
         return False
 
@@ -450,30 +666,37 @@ class CommandManager:
         if not self.redo_stack:
             return False
 
+        self._last_execute = float('-inf')
         command = self.redo_stack.pop()
         if command.execute():
-            self.undo_stack.append(command)
-            self._save_state()
+            self._push_undo(command)
             return True
         return False
 
     def save_to_file(self, filename: str) -> bool:
         try:
             data = {
-                'history': [{
-                    'map_state': self._get_safe_state(),
-                    'undo_stack': self._serialize_commands(self.undo_stack),
-                    'redo_stack': self._serialize_commands(self.redo_stack)
-                }],
-                'current_index': 0,
+                'initial_state': self._initial_state(),
+                'undo_log': self._serialize_commands(self.undo_stack),
+                'redo_log': self._serialize_commands(self.redo_stack),
                 '_metadata': {
-                    'version': '1.2',
+                    'version': '1.3',
                     'created': datetime.now().isoformat()
                 }
             }
 
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            # пишем во временный файл рядом и подменяем им старый: при сбое
+            # во время записи прежний файл остаётся целым
+            fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb', buffering=1 << 20) as f:
+                    json_dump(data, f)
+                # mkstemp создаёт файл с правами 0600, сохраняем права прежнего файла
+                os.chmod(tmp_name, os.stat(filename).st_mode if os.path.exists(filename) else 0o644)
+                os.replace(tmp_name, filename)
+            except BaseException:
+                os.unlink(tmp_name)
+                raise
             return True
         except Exception as e:
             print(f"Save error: {str(e)}")
@@ -481,75 +704,88 @@ class CommandManager:
 
     def load_from_file(self, filename: str) -> bool:
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            self.history = data.get('history', [])
-            self.current_history_index = data.get('current_index', 0)
-
-            if not self.history:
-                return False
-
-            state = self.history[self.current_history_index]
-
-            # проверка и преобразование map_state
-            map_state = state.get('map_state', {})
-            if isinstance(map_state, str):
-                map_state = json.loads(map_state)
-
-            self.city_map.from_dict(map_state)
-
-            # восстановление команд
-            self.undo_stack = self._deserialize_commands(state.get('undo_stack', []))
-            self.redo_stack = self._deserialize_commands(state.get('redo_stack', []))
-
-            return True
+            with open(filename, 'rb') as f:
+                data = json_load(f)
+
+            # журнал повторяется на отдельной карте со своими стеками: при ошибке
+            # посреди файла текущая карта и история остаются нетронутыми
+            staging = CommandManager(CityMap())
+            if 'initial_state' in data:
+                staging._load_command_log(data)
+            else:
+                staging._load_snapshot_history(data)
         except Exception as e:
             print(f"Load error: {str(e)}")
             return False
 
+        self._adopt(staging)
+        return True
+
+    def _adopt(self, staging: 'CommandManager'):
+        """Подменить карту и историю успешно загруженными"""
+        self.city_map.adopt(staging.city_map)
+        for command in staging.undo_stack:
+            command.city_map = self.city_map
+        for command in staging.redo_stack:
+            command.city_map = self.city_map
+        self.initial_state = staging.initial_state
+        self._base_map = staging._base_map
+        self.undo_stack = staging.undo_stack
+        self.redo_stack = staging.redo_stack
+        self._last_execute = float('-inf')
+
+    def _load_command_log(self, data: dict):
+        """Формат 1.3: начальное состояние и повтор журнала команд"""
+        self.initial_state = data['initial_state']
+        self._base_map = None
+        self.city_map.from_dict(self.initial_state)
+
+        self.undo_stack = deque()
+        for command in self._deserialize_commands(data.get('undo_log', [])):
+            if not command.execute():
+                raise ValueError(f"Cannot replay {type(command).__name__}")
+            self._push_undo(command)
+        self.redo_stack = deque(self._deserialize_commands(data.get('redo_log', [])),
+                                maxlen=self.MAX_HISTORY)
+
+    def _load_snapshot_history(self, data: dict):
+        """Формат 1.2: снимок текущего состояния и стеки команд"""
+        history = data.get('history', [])
+        if not history:
+            raise ValueError("Empty history")
+
+        state = history[data.get('current_index', 0)]
+
+        # проверка и преобразование map_state
+        map_state = state.get('map_state', {})
+        if isinstance(map_state, str):
+            map_state = json_loads(map_state)
+
+        self.city_map.from_dict(map_state)
+
+        # восстановление команд
+        undo_commands = self._deserialize_commands(state.get('undo_stack', []))
+        self.redo_stack = deque(self._deserialize_commands(state.get('redo_stack', [])),
+                                maxlen=self.MAX_HISTORY)
+
+        # начальное состояние получаем откатом всех команд и возвращаемся обратно
+        for command in reversed(undo_commands):
+            command.undo()
+        self.initial_state = self._get_safe_state()
+        self._base_map = None
+        self.undo_stack = deque()
+        for command in undo_commands:
+            command.execute()
+            self._push_undo(command)
+
     def _deserialize_commands(self, commands_data):
         """Восстановление всех типов команд"""
         commands = []
         for cmd_data in commands_data:
-            cmd = None
             try:
-                if cmd_data['type'] == 'AddCityCommand':
-                    cmd = AddCityCommand(self.city_map, cmd_data['name'])
-                elif cmd_data['type'] == 'RemoveCityCommand':
-                    cmd = RemoveCityCommand(self.city_map, cmd_data['name'])
-                    cmd.roads = cmd_data.get('roads', [])
-                elif cmd_data['type'] == 'RenameCityCommand':
-                    cmd = RenameCityCommand(
-                        self.city_map,
-                        cmd_data['old_name'],
-                        cmd_data['new_name']
-                    )
-                elif cmd_data['type'] == 'AddRoadCommand':
-                    cmd = AddRoadCommand(
-                        self.city_map,
-                        cmd_data['city1'],
-                        cmd_data['city2'],
-                        cmd_data['cost']
-                    )
-                elif cmd_data['type'] == 'RemoveRoadCommand':
-                    cmd = RemoveRoadCommand(
-                        self.city_map,
-                        cmd_data['city1'],
-                        cmd_data['city2'],
-                        cmd_data['cost']
-                    )
-                elif cmd_data['type'] == 'UpdateRoadCommand':
-                    cmd = UpdateRoadCommand(
-                        self.city_map,
-                        cmd_data['city1'],
-                        cmd_data['city2'],
-                        cmd_data['old_cost'],
-                        cmd_data['new_cost']
-                    )
-
-                if cmd:
-                    commands.append(cmd)
+                deserializer = COMMAND_DESERIALIZERS.get(cmd_data['type'])
+                if deserializer:
+                    commands.append(deserializer(self.city_map, cmd_data))
             except:
                 continue
         return commands
@@ -557,6 +793,20 @@ class CommandManager:
 #endregion
 
 # region Визуализация
+@lru_cache(maxsize=64)
+def circle_layout(count: int, center_x: float = 300, center_y: float = 300,
+                  radius: float = 250) -> Tuple[Tuple[float, float], ...]:
+    """Координаты count точек, равномерно распределённых по окружности.
+
+    Раскладка зависит только от аргументов, поэтому запоминается: при
+    неизменном числе городов тригонометрия не пересчитывается.
+    """
+    angle_step = 2 * math.pi / count
+    cos, sin = math.cos, math.sin
+    return tuple((center_x + radius * cos(i * angle_step), center_y + radius * sin(i * angle_step))
+                 for i in range(count))
+
+
 class CityGraphicsView(QGraphicsView):
     """Виджет для визуализации карты городов"""
 
@@ -570,75 +820,129 @@ class CityGraphicsView(QGraphicsView):
         # позиции городов для визуализации
         self.city_positions = {}
 
-    def update_map(self, city_map: CityMap):
-        """Обновить визуализацию карты"""
-        self.scene.clear()
-        self.city_positions = {}
-
-        cities = city_map.get_cities()
-        if not cities:
-            return
+        # элементы сцены прошлой отрисовки, переиспользуются при следующем обновлении
+        self._city_items: Dict[str, Tuple[QGraphicsEllipseItem, QGraphicsTextItem, float]] = {}
+        # подпись дороги: (элемент, стоимость, половина ширины, половина высоты)
+        self._road_items: Dict[Tuple[str, str, int], Tuple[QGraphicsTextItem, int, float, float]] = {}
 
-        # распределяем города по кругу
-        center = QPointF(300, 300)
-        radius = 250
-        angle_step = 360 / len(cities)
+        # все линии дорог - один элемент сцены с общим контуром
+        self._roads_path_item = QGraphicsPathItem()
+        self._roads_path_item.setPen(QPen(QColor(70, 130, 180), 2))
+        self._roads_path_item.setZValue(1)  # дороги поверх городов
+        self.scene.addItem(self._roads_path_item)
 
-        for i, city in enumerate(cities):
-            angle = i * angle_step
-            x = center.x() + radius * math.cos(math.radians(angle))
-            y = center.y() + radius * math.sin(math.radians(angle))
-            self.city_positions[city] = QPointF(x, y)
+        # какая карта и в какой версии нарисована сейчас
+        self._drawn: Optional[Tuple[CityMap, int]] = None
+        # список городов, по которому рассчитаны city_positions
+        self._layout_cities: List[str] = []
 
-            # рисуем город (круг с названием)
-            ellipse = QGraphicsEllipseItem(x - 20, y - 20, 40, 40)
-            ellipse.setBrush(QColor(255, 215, 0))  # золотой цвет
-            self.scene.addItem(ellipse)
+    def update_map(self, city_map: CityMap):
+        """Обновить визуализацию карты: создаются и удаляются только изменившиеся элементы"""
+        if self._drawn == (city_map, city_map.version):
+            return  # карта не менялась с прошлой отрисовки
+        self._drawn = (city_map, city_map.version)
 
-            text = self.scene.addText(city)
-            text.setPos(x - text.boundingRect().width() / 2, y - 30)
-            text.setDefaultTextColor(QColor(0, 0, 0))
+        # города и их раскладка меняются только при изменении списка городов;
+        # после правки дорог круги и подписи городов остаются на месте
+        cities = city_map.get_cities()
+        if cities != self._layout_cities:
+            self._layout_cities = cities
+            self.city_positions = {}
+
+            # распределяем города по кругу
+            city_items = {}
+            for city, (x, y) in zip(cities, circle_layout(len(cities)) if cities else []):
+                self.city_positions[city] = QPointF(x, y)
+
+                item = self._city_items.pop(city, None)
+                if item is None:
+                    # рисуем город (круг с названием)
+                    ellipse = QGraphicsEllipseItem()
+                    ellipse.setBrush(QColor(255, 215, 0))  # золотой цвет
+                    self.scene.addItem(ellipse)
+
+                    text = self.scene.addText(city)
+                    text.setDefaultTextColor(QColor(0, 0, 0))
+                    item = (ellipse, text, text.boundingRect().width() / 2)
+
+                ellipse, text, half_width = item
+                ellipse.setRect(x - 20, y - 20, 40, 40)
+                text.setPos(x - half_width, y - 30)
+                city_items[city] = item
+
+            for ellipse, text, _ in self._city_items.values():
+                self.scene.removeItem(ellipse)
+                self.scene.removeItem(text)
+            self._city_items = city_items
 
         # рисуем дороги
-        for city1, city2, costs in city_map.get_all_roads():
+        roads_path = QPainterPath()
+        road_items = {}
+        for city1, city2, edges in city_map.get_all_road_edges():
             pos1 = self.city_positions[city1]
             pos2 = self.city_positions[city2]
+            x1, y1, x2, y2 = pos1.x(), pos1.y(), pos2.x(), pos2.y()
+            mid_x, mid_y = (x1 + x2) / 2, (y1 + y2) / 2
+
+            # единичная нормаль к линии: параллельные дороги смещаются вдоль неё
+            count = len(edges)
+            nx = ny = 0.0
+            if count > 1:
+                nx, ny = y2 - y1, x1 - x2
+                length = math.hypot(nx, ny)
+                if length > 0:
+                    nx /= length
+                    ny /= length
 
             # рисуем отдельную линию для каждой дороги
-            for i, cost in enumerate(costs):
-                line = QGraphicsLineItem(pos1.x(), pos1.y(), pos2.x(), pos2.y())
-
+            for i, (edge_id, cost) in enumerate(edges):
                 # смещаем параллельные дороги для лучшей визуализации
-                if len(costs) > 1:
-                    offset = 10 * (i - (len(costs) - 1) / 2)
-                    dx = pos2.y() - pos1.y()
-                    dy = -(pos2.x() - pos1.x())
-                    length = math.sqrt(dx * dx + dy * dy)
-                    if length > 0:
-                        dx = dx / length * offset
-                        dy = dy / length * offset
-                        line.setLine(pos1.x() + dx, pos1.y() + dy,
-                                     pos2.x() + dx, pos2.y() + dy)
-
-                pen = QPen(QColor(70, 130, 180), 2)
-                line.setPen(pen)
-                self.scene.addItem(line)
+                offset = 10 * (i - (count - 1) / 2)
+                dx = nx * offset
+                dy = ny * offset
+
+                roads_path.moveTo(x1 + dx, y1 + dy)
+                roads_path.lineTo(x2 + dx, y2 + dy)
+
+                key = (city1, city2, edge_id)
+                item = self._road_items.pop(key, None)
+                if item is None or item[1] != cost:
+                    if item is None:
+                        label = self.scene.addText(str(cost))
+                        label.setDefaultTextColor(QColor(0, 0, 0))
+                        label.setZValue(1)
+                    else:
+                        label = item[0]
+                        label.setPlainText(str(cost))
+                    # размер подписи зависит только от текста: измеряем при его смене
+                    rect = label.boundingRect()
+                    item = (label, cost, rect.width() / 2, rect.height() / 2)
+
+                label, _, half_width, half_height = item
 
                 # подпись стоимости дороги (посередине линии)
-                mid_x = (pos1.x() + pos2.x()) / 2
-                mid_y = (pos1.y() + pos2.y()) / 2
-                if len(costs) > 1:
-                    mid_x += dx / 2
-                    mid_y += dy / 2
+                label.setPos(mid_x + dx / 2 - half_width, mid_y + dy / 2 - half_height)
+                road_items[key] = item
 
-                text = self.scene.addText(str(cost))
-                text.setPos(mid_x - text.boundingRect().width() / 2,
-                            mid_y - text.boundingRect().height() / 2)
-                text.setDefaultTextColor(QColor(0, 0, 0))
+        for label, *_ in self._road_items.values():
+            self.scene.removeItem(label)
+        self._road_items = road_items
+        self._roads_path_item.setPath(roads_path)
 
 # endregion
 
 # region Главное окно
+# допустимое название города: до 64 любых символов, кроме управляющих;
+# апострофы, скобки и прочая пунктуация в названиях встречаются
+CITY_NAME_RE = re.compile(r"[^\x00-\x1f\x7f-\x9f]{1,64}")
+
+
+@lru_cache(maxsize=4096)
+def road_label(city: str, cost: int) -> str:
+    """Подпись дороги в списке; строки для неизменившихся дорог берутся из кеша"""
+    return f"{city} (стоимость: {cost})"
+
+
 class CityMapApp(QMainWindow):
     """Главное окно приложения"""
 
@@ -649,6 +953,22 @@ class CityMapApp(QMainWindow):
 
         self.city_map = CityMap()
         self.command_manager = CommandManager(self.city_map)
+        # города в том порядке, в каком они сейчас показаны в списке и комбобоксах
+        self._shown_cities: List[str] = []
+        # номер строки каждого города в списке и комбобоксах (вместо findText)
+        self._city_rows: Dict[str, int] = {}
+        # версия карты, которую сейчас показывает интерфейс
+        self._shown_version = -1
+
+        # обновления интерфейса после команд откладываются до возврата в цикл
+        # событий: несколько команд подряд дают одну перерисовку
+        self._update_timer = QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(0)
+        self._update_timer.timeout.connect(self.update_ui)
+
+        # окна сообщений создаются один раз на каждый вид и затем переиспользуются
+        self._message_boxes: Dict[Tuple[int, str], QMessageBox] = {}
 
         self.init_ui()
         self.update_ui()
@@ -681,9 +1001,13 @@ class CityMapApp(QMainWindow):
         add_city_btn.clicked.connect(self.add_city)
         add_city_layout.addWidget(add_city_btn)
 
-        # список городов
-        self.cities_list = QListWidget()
-        self.cities_list.itemSelectionChanged.connect(self.on_city_selected)
+        # список городов: строки хранятся в модели без отдельного объекта на строку
+        self.cities_list = QListView()
+        self._cities_model = QStringListModel(self)
+        self.cities_list.setModel(self._cities_model)
+        self.cities_list.setEditTriggers(QListView.NoEditTriggers)
+        self.cities_list.setUniformItemSizes(True)  # все строки одной высоты, без промера каждой
+        self.cities_list.selectionModel().selectionChanged.connect(self.on_city_selected)
         left_panel.addWidget(QLabel("Города:"))
         left_panel.addWidget(self.cities_list)
 
@@ -718,6 +1042,10 @@ class CityMapApp(QMainWindow):
         self.city2_combo = QComboBox()
         road_cities_layout.addWidget(self.city2_combo)
 
+        shortest_path_btn = QPushButton("Кратчайший путь")
+        shortest_path_btn.clicked.connect(self.find_shortest_path)
+        road_cities_layout.addWidget(shortest_path_btn)
+
         # стоимость дороги
         road_cost_layout = QHBoxLayout()
         road_management_layout.addLayout(road_cost_layout)
@@ -734,6 +1062,7 @@ class CityMapApp(QMainWindow):
 
         # список дорог для выбранного города
         self.roads_list = QListWidget()
+        self.roads_list.setUniformItemSizes(True)
         self.roads_list.itemSelectionChanged.connect(self.on_road_selected)
         road_management_layout.addWidget(QLabel("Дороги из выбранного города:"))
         road_management_layout.addWidget(self.roads_list)
@@ -804,33 +1133,100 @@ class CityMapApp(QMainWindow):
         redo_action.triggered.connect(self.redo)
         edit_menu.addAction(redo_action)
 
+    def show_message(self, text: str, icon=QMessageBox.Warning, title: str = "Ошибка"):
+        """Показать модальное сообщение в переиспользуемом окне"""
+        box = self._message_boxes.get((icon, title))
+        if box is None:
+            box = self._message_boxes[icon, title] = QMessageBox(icon, title, "", QMessageBox.Ok, self)
+        box.setText(text)
+        box.exec_()
+
+    @contextmanager
+    def _bulk_update(self):
+        """Пакетное обновление списков и комбобоксов: без перерисовки и без сигналов.
+
+        Иначе каждая вставка/удаление строки перерисовывает виджет и через
+        currentIndexChanged повторно вызывает update_roads_list.
+        """
+        widgets = (self.cities_list, self.roads_list, self.city1_combo, self.city2_combo)
+        blockers = [QSignalBlocker(widget) for widget in widgets]
+        blockers.append(QSignalBlocker(self.cities_list.selectionModel()))
+        updates = [widget.updatesEnabled() for widget in widgets]
+        for widget in widgets:
+            widget.setUpdatesEnabled(False)
+        try:
+            yield
+        finally:
+            for widget, enabled in zip(widgets, updates):
+                widget.setUpdatesEnabled(enabled)
+            for blocker in blockers:
+                blocker.unblock()
+
+    def schedule_update(self):
+        """Запланировать update_ui; повторные вызовы до его выполнения объединяются"""
+        if not self._update_timer.isActive():
+            self._update_timer.start()
+
     def update_ui(self):
         """Обновить пользовательский интерфейс"""
-        # обновить списки городов
+        self._update_timer.stop()
+        if self.city_map.version == self._shown_version:
+            return  # карта не менялась, показывать нечего
+        self._shown_version = self.city_map.version
+
         cities = self.city_map.get_cities()
-        self.cities_list.clear()
-        self.cities_list.addItems(cities)
+        with self._bulk_update():
+            # после правки дорог список городов прежний, обновлять его не нужно
+            if cities != self._shown_cities:
+                self.sync_cities(cities)
+            self.update_roads_list()
 
-        # обновить комбобоксы
+        # обновить визуализацию
+        self.graphics_view.update_map(self.city_map)
+
+    def sync_cities(self, cities: List[str]):
+        """Привести список городов и комбобоксы к cities, меняя только отличающиеся строки"""
+        shown = self._shown_cities
         current_city1 = self.city1_combo.currentText()
         current_city2 = self.city2_combo.currentText()
 
-        self.city1_combo.clear()
-        self.city2_combo.clear()
-        self.city1_combo.addItems(cities)
-        self.city2_combo.addItems(cities)
-
-        # восстановить выбранные города
-        if current_city1 in cities:
-            self.city1_combo.setCurrentText(current_city1)
-        if current_city2 in cities:
-            self.city2_combo.setCurrentText(current_city2)
-
-        # обновить список дорог
-        self.update_roads_list()
-
-        # обновить визуализацию
-        self.graphics_view.update_map(self.city_map)
+        # команда меняет один участок списка: отбрасываем общие начало и конец
+        start = 0
+        common = min(len(shown), len(cities))
+        while start < common and shown[start] == cities[start]:
+            start += 1
+        old_end, new_end = len(shown), len(cities)
+        while old_end > start and new_end > start and shown[old_end - 1] == cities[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+
+        inserted = cities[start:new_end]
+        model = self._cities_model
+        if start == 0 and old_end == len(shown) and new_end == len(cities):
+            # общих строк нет (первое заполнение, загрузка файла) - один сброс модели
+            model.setStringList(cities)
+        else:
+            model.removeRows(start, old_end - start)
+            model.insertRows(start, len(inserted))
+            for row, name in enumerate(inserted, start):
+                model.setData(model.index(row), name)
+        for _ in range(old_end - start):
+            self.city1_combo.removeItem(start)
+            self.city2_combo.removeItem(start)
+        self.city1_combo.insertItems(start, inserted)
+        self.city2_combo.insertItems(start, inserted)
+        self._shown_cities = cities
+
+        # номера строк меняются только начиная с изменённого участка
+        rows = self._city_rows
+        for name in shown[start:old_end]:
+            del rows[name]
+        for row in range(start, len(cities)):
+            rows[cities[row]] = row
+
+        # если выбранный город исчез, выбираем первый, как после заполнения с нуля
+        for combo, current in ((self.city1_combo, current_city1), (self.city2_combo, current_city2)):
+            combo.setCurrentIndex(rows.get(current, 0 if cities else -1))
 
     def update_roads_list(self):
         """Обновить список дорог для выбранного города"""
@@ -839,31 +1235,37 @@ class CityMapApp(QMainWindow):
         if not city:
             return
 
-        roads = self.city_map.get_roads_from_city(city)
-        for neighbor, costs in roads:
-            for cost in costs:
-                self.roads_list.addItem(f"{neighbor} (стоимость: {cost})")
+        roads = [(neighbor, cost) for neighbor, costs in self.city_map.get_roads_from_city(city)
+                 for cost in costs]
+        # одна вставка в модель вместо addItem на каждую дорогу
+        self.roads_list.addItems([road_label(neighbor, cost) for neighbor, cost in roads])
+        # (город, стоимость) храним в самом элементе, чтобы не разбирать его текст
+        for row, road in enumerate(roads):
+            self.roads_list.item(row).setData(Qt.UserRole, road)
+
+    def selected_city(self) -> Optional[str]:
+        """Город, выбранный в списке городов, или None"""
+        indexes = self.cities_list.selectionModel().selectedIndexes()
+        return indexes[0].data() if indexes else None
 
     def on_city_selected(self):
         """Обработчик выбора города"""
-        selected_items = self.cities_list.selectedItems()
-        if selected_items:
-            city = selected_items[0].text()
-            index = self.city1_combo.findText(city)
-            if index >= 0:
+        city = self.selected_city()
+        if city is not None:
+            index = self._city_rows.get(city, -1)
+            # список дорог перестраивает сигнал currentIndexChanged; если город
+            # уже выбран в комбобоксе, список актуален и трогать его не нужно
+            if index >= 0 and self.city1_combo.currentIndex() != index:
                 self.city1_combo.setCurrentIndex(index)
-        self.update_roads_list()
 
     def on_road_selected(self):
         """Обработчик выбора дороги"""
         selected_items = self.roads_list.selectedItems()
         if selected_items:
-            road_text = selected_items[0].text()
-            city2 = road_text.split(" (")[0]
-            cost = int(road_text.split(": ")[1].rstrip(")"))
+            city2, cost = selected_items[0].data(Qt.UserRole)
 
-            index = self.city2_combo.findText(city2)
-            if index >= 0:
+            index = self._city_rows.get(city2, -1)
+            if index >= 0 and self.city2_combo.currentIndex() != index:
                 self.city2_combo.setCurrentIndex(index)
 
             self.new_cost_input.setValue(cost)
@@ -872,54 +1274,68 @@ class CityMapApp(QMainWindow):
         """Добавить новый город"""
         city_name = self.city_name_input.text().strip()
         if not city_name:
-            QMessageBox.warning(self, "Ошибка", "Введите название города")
+            self.show_message("Введите название города")
+            return
+
+        if not CITY_NAME_RE.fullmatch(city_name):
+            self.show_message("Недопустимое название города")
+            return
+
+        if city_name in self.city_map.cities:
+            self.show_message("Город с таким именем уже существует")
             return
 
         command = AddCityCommand(self.city_map, city_name)
         if self.command_manager.execute_command(command):
             self.city_name_input.clear()
-            self.update_ui()
+            self.schedule_update()
         else:
-            QMessageBox.warning(self, "Ошибка", "Город с таким именем уже существует")
+            self.show_message("Город с таким именем уже существует")
 
     def remove_city(self):
         """Удалить выбранный город"""
-        selected_items = self.cities_list.selectedItems()
-        if not selected_items:
-            QMessageBox.warning(self, "Ошибка", "Выберите город для удаления")
+        city_name = self.selected_city()
+        if city_name is None:
+            self.show_message("Выберите город для удаления")
             return
 
-        city_name = selected_items[0].text()
         command = RemoveCityCommand(self.city_map, city_name)
         if self.command_manager.execute_command(command):
-            self.update_ui()
+            self.schedule_update()
         else:
-            QMessageBox.warning(self, "Ошибка", "Не удалось удалить город")
+            self.show_message("Не удалось удалить город")
 
     def rename_city(self):
         """Переименовать выбранный город"""
-        selected_items = self.cities_list.selectedItems()
-        if not selected_items:
-            QMessageBox.warning(self, "Ошибка", "Выберите город для переименования")
+        old_name = self.selected_city()
+        if old_name is None:
+            self.show_message("Выберите город для переименования")
             return
 
-        old_name = selected_items[0].text()
         new_name = self.rename_city_input.text().strip()
         if not new_name:
-            QMessageBox.warning(self, "Ошибка", "Введите новое название города")
+            self.show_message("Введите новое название города")
             return
 
         if old_name == new_name:
-            QMessageBox.warning(self, "Ошибка", "Новое название должно отличаться от старого")
+            self.show_message("Новое название должно отличаться от старого")
+            return
+
+        if not CITY_NAME_RE.fullmatch(new_name):
+            self.show_message("Недопустимое название города")
+            return
+
+        if new_name in self.city_map.cities:
+            self.show_message("Город с таким именем уже существует")
             return
 
         command = RenameCityCommand(self.city_map, old_name, new_name)
         if self.command_manager.execute_command(command):
             self.rename_city_input.clear()
-            self.update_ui()
+            self.schedule_update()
         else:
-            QMessageBox.warning(self, "Ошибка",
-                                "Не удалось переименовать город (возможно, город с таким именем уже существует)")
+            self.show_message(
+                "Не удалось переименовать город (возможно, город с таким именем уже существует)")
 
     def add_road(self):
         """Добавить дорогу между городами"""
@@ -928,69 +1344,81 @@ class CityMapApp(QMainWindow):
         cost = self.road_cost_input.value()
 
         if not city1 or not city2:
-            QMessageBox.warning(self, "Ошибка", "Выберите оба города")
+            self.show_message("Выберите оба города")
             return
 
         if city1 == city2:
-            QMessageBox.warning(self, "Ошибка", "Нельзя создать дорогу между одним и тем же городом")
+            self.show_message("Нельзя создать дорогу между одним и тем же городом")
             return
 
         command = AddRoadCommand(self.city_map, city1, city2, cost)
         if self.command_manager.execute_command(command):
-            self.update_ui()
+            self.schedule_update()
         else:
-            QMessageBox.warning(self, "Ошибка", "Не удалось добавить дорогу")
+            self.show_message("Не удалось добавить дорогу")
 
     def remove_road(self):
         """Удалить выбранную дорогу"""
         selected_items = self.roads_list.selectedItems()
         if not selected_items:
-            QMessageBox.warning(self, "Ошибка", "Выберите дорогу для удаления")
+            self.show_message("Выберите дорогу для удаления")
             return
 
         city1 = self.city1_combo.currentText()
-        road_text = selected_items[0].text()
-        city2 = road_text.split(" (")[0]
-        cost = int(road_text.split(": ")[1].rstrip(")"))
+        city2, cost = selected_items[0].data(Qt.UserRole)
 
         command = RemoveRoadCommand(self.city_map, city1, city2, cost)
         if self.command_manager.execute_command(command):
-            self.update_ui()
+            self.schedule_update()
         else:
-            QMessageBox.warning(self, "Ошибка", "Не удалось удалить дорогу")
+            self.show_message("Не удалось удалить дорогу")
 
     def update_road_cost(self):
         """Изменить стоимость выбранной дороги"""
         selected_items = self.roads_list.selectedItems()
         if not selected_items:
-            QMessageBox.warning(self, "Ошибка", "Выберите дорогу для изменения")
+            self.show_message("Выберите дорогу для изменения")
             return
 
-        city1 = self.city1_combo.currentText()
-        road_text = selected_items[0].text()
-        city2 = road_text.split(" (")[0]
-        old_cost = int(road_text.split(": ")[1].rstrip(")"))
+        city2, old_cost = selected_items[0].data(Qt.UserRole)
         new_cost = self.new_cost_input.value()
-
         if old_cost == new_cost:
-            QMessageBox.warning(self, "Ошибка", "Новая стоимость должна отличаться от текущей")
+            self.show_message("Новая стоимость должна отличаться от текущей")
             return
 
+        city1 = self.city1_combo.currentText()
         command = UpdateRoadCommand(self.city_map, city1, city2, old_cost, new_cost)
         if self.command_manager.execute_command(command):
-            self.update_ui()
+            self.schedule_update()
         else:
-            QMessageBox.warning(self, "Ошибка", "Не удалось изменить стоимость дороги")
+            self.show_message("Не удалось изменить стоимость дороги")
+
+    def find_shortest_path(self):
+        """Показать кратчайший путь между выбранными городами"""
+        city1 = self.city1_combo.currentText()
+        city2 = self.city2_combo.currentText()
+        if not city1 or not city2:
+            self.show_message("Выберите оба города")
+            return
+
+        result = self.city_map.shortest_path(city1, city2)
+        if result is None:
+            self.show_message(f"Пути из {city1} в {city2} нет",
+                              QMessageBox.Information, "Кратчайший путь")
+            return
+        cost, path = result
+        self.show_message(f"{' → '.join(path)}\nСтоимость: {cost}",
+                          QMessageBox.Information, "Кратчайший путь")
 
     def undo(self):
         """Отменить последнее действие"""
         if self.command_manager.undo():
-            self.update_ui()
+            self.schedule_update()
 
     def redo(self):
         """Повторить отмененное действие"""
         if self.command_manager.redo():
-            self.update_ui()
+            self.schedule_update()
 
     def save_to_file(self):
         filename, _ = QFileDialog.getSaveFileName(
@@ -999,19 +1427,19 @@ class CityMapApp(QMainWindow):
             if not filename.endswith('.json'):
                 filename += '.json'
             if self.command_manager.save_to_file(filename):
-                QMessageBox.information(self, "Успех", "Файл сохранен с историей изменений!")
+                self.show_message("Файл сохранен с историей изменений!", QMessageBox.Information, "Успех")
             else:
-                QMessageBox.critical(self, "Ошибка", "Ошибка при сохранении файла")
+                self.show_message("Ошибка при сохранении файла", QMessageBox.Critical)
 
     def load_from_file(self):
         filename, _ = QFileDialog.getOpenFileName(
             self, "Загрузить карту", "", "JSON Files (*.json)")
         if filename:
             if self.command_manager.load_from_file(filename):
-                self.update_ui()
-                QMessageBox.information(self, "Успех", "Файл загружен с историей изменений!")
+                self.schedule_update()
+                self.show_message("Файл загружен с историей изменений!", QMessageBox.Information, "Успех")
             else:
-                QMessageBox.critical(self, "Ошибка", "Ошибка при загрузке файла")
+                self.show_message("Ошибка при загрузке файла", QMessageBox.Critical)
 
 #endregion
 
@@ -0,0 +1,222 @@
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_spec = importlib.util.spec_from_file_location("city_map_app", os.path.join(HERE, "2.py"))
+app = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(app)
+# модуль ставит свой обработчик исключений с окном Qt, в тестах он не нужен
+sys.excepthook = sys.__excepthook__
+
+CITIES = ["A", "B", "C", "D", "E"]
+
+
+def roads(city_map):
+    """Карта без id дорог: {город: {сосед: отсортированные стоимости}}"""
+    return {city: {neighbor: sorted(edges.values()) for neighbor, edges in neighbors.items()}
+            for city, neighbors in city_map.cities.items()}
+
+
+def random_session(manager, rnd, steps=60):
+    """Случайная последовательность команд, отмен и повторов"""
+    city_map = manager.city_map
+    for _ in range(steps):
+        r = rnd.random()
+        a, b = rnd.choice(CITIES), rnd.choice(CITIES)
+        cost, new_cost = rnd.randint(1, 3), rnd.randint(1, 3)
+        if r < .2:
+            manager.execute_command(app.AddCityCommand(city_map, a))
+        elif r < .3:
+            manager.execute_command(app.RemoveCityCommand(city_map, a))
+        elif r < .38:
+            manager.execute_command(app.RenameCityCommand(city_map, a, rnd.choice(CITIES + ["F"])))
+        elif r < .6:
+            manager.execute_command(app.AddRoadCommand(city_map, a, b, cost))
+        elif r < .72:
+            manager.execute_command(app.RemoveRoadCommand(city_map, a, b, cost))
+        elif r < .82:
+            manager.execute_command(app.UpdateRoadCommand(city_map, a, b, cost, new_cost))
+        elif r < .92:
+            manager.undo()
+        else:
+            manager.redo()
+
+
+class CommandManagerFileTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def reload(self, manager):
+        self.assertTrue(manager.save_to_file(self.path))
+        loaded = app.CommandManager(app.CityMap())
+        self.assertTrue(loaded.load_from_file(self.path))
+        return loaded
+
+    def assertSameHistory(self, manager, loaded):
+        self.assertEqual(roads(loaded.city_map), roads(manager.city_map))
+        while manager.undo():
+            pass
+        while loaded.undo():
+            pass
+        self.assertEqual(roads(loaded.city_map), roads(manager.city_map))
+        while manager.redo():
+            pass
+        while loaded.redo():
+            pass
+        self.assertEqual(roads(loaded.city_map), roads(manager.city_map))
+
+    def test_round_trip(self):
+        for seed in range(50):
+            with self.subTest(seed=seed):
+                manager = app.CommandManager(app.CityMap())
+                random_session(manager, random.Random(seed))
+                self.assertSameHistory(manager, self.reload(manager))
+
+    def test_round_trip_after_folding(self):
+        for seed in range(50):
+            with self.subTest(seed=seed):
+                manager = app.CommandManager(app.CityMap())
+                manager.MAX_HISTORY = 4
+                random_session(manager, random.Random(seed))
+                loaded = self.reload(manager)
+                loaded.MAX_HISTORY = 4
+                self.assertSameHistory(manager, loaded)
+
+    def test_load_snapshot_format(self):
+        for name in ["1.json", "123.json", "simple_program.json", "sophisticated_program.json"]:
+            with self.subTest(file=name):
+                with open(os.path.join(HERE, name), encoding="utf-8") as f:
+                    state = json.load(f)["history"][0]
+                manager = app.CommandManager(app.CityMap())
+                self.assertTrue(manager.load_from_file(os.path.join(HERE, name)))
+
+                expected = app.CityMap()
+                expected.from_dict(state["map_state"])
+                self.assertEqual(roads(manager.city_map), roads(expected))
+                self.assertEqual(len(manager.undo_stack), len(state["undo_stack"]))
+
+                # файл 1.2 пересохраняется в формате 1.3 без потери истории
+                self.assertSameHistory(manager, self.reload(manager))
+
+    def test_failed_load_keeps_current_state(self):
+        manager = app.CommandManager(app.CityMap())
+        manager.execute_command(app.AddCityCommand(manager.city_map, "X"))
+        manager.execute_command(app.AddCityCommand(manager.city_map, "Y"))
+        manager.undo()
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({
+                'initial_state': {'cities': {'A': {}}, '_version': '1.2'},
+                'undo_log': [{'type': 'AddCityCommand', 'name': 'B'},
+                             {'type': 'AddRoadCommand', 'city1': 'A', 'city2': 'Q', 'cost': 1}],
+                'redo_log': [],
+                '_metadata': {'version': '1.3'}
+            }, f)
+
+        self.assertFalse(manager.load_from_file(self.path))
+        self.assertEqual(manager.city_map.get_cities(), ["X"])
+        self.assertTrue(manager.redo())
+        self.assertEqual(manager.city_map.get_cities(), ["X", "Y"])
+
+
+class CommandManagerHistoryTest(unittest.TestCase):
+    def test_undo_redo_after_folding(self):
+        city_map = app.CityMap()
+        manager = app.CommandManager(city_map)
+        manager.MAX_HISTORY = 3
+        for name in CITIES:
+            manager.execute_command(app.AddCityCommand(city_map, name))
+        self.assertEqual(len(manager.undo_stack), 3)
+
+        while manager.undo():
+            pass
+        # две самые старые команды вытеснены в базовую карту и не отменяются
+        self.assertEqual(city_map.get_cities(), ["A", "B"])
+        self.assertEqual(manager._initial_state()['cities'], {"A": {}, "B": {}})
+
+        while manager.redo():
+            pass
+        self.assertEqual(city_map.get_cities(), CITIES)
+
+    def test_coalesce_cost_edits(self):
+        city_map = app.CityMap()
+        manager = app.CommandManager(city_map)
+        for name in "AB":
+            manager.execute_command(app.AddCityCommand(city_map, name))
+        manager.execute_command(app.AddRoadCommand(city_map, "A", "B", 1))
+
+        manager.execute_command(app.UpdateRoadCommand(city_map, "A", "B", 1, 2))
+        manager.execute_command(app.UpdateRoadCommand(city_map, "B", "A", 2, 3))
+        self.assertEqual(len(manager.undo_stack), 4)
+        self.assertTrue(manager.undo())
+        self.assertEqual(roads(city_map)["A"]["B"], [1])
+
+        # после повтора новая правка начинает свою команду
+        self.assertTrue(manager.redo())
+        manager.execute_command(app.UpdateRoadCommand(city_map, "A", "B", 3, 5))
+        self.assertEqual(len(manager.undo_stack), 5)
+
+    def test_remove_missing_road_is_rejected(self):
+        city_map = app.CityMap()
+        manager = app.CommandManager(city_map)
+        for name in "AB":
+            manager.execute_command(app.AddCityCommand(city_map, name))
+        manager.execute_command(app.AddRoadCommand(city_map, "A", "B", 1))
+
+        self.assertFalse(manager.execute_command(app.RemoveRoadCommand(city_map, "A", "B", 7)))
+        self.assertEqual(len(manager.undo_stack), 3)
+
+
+class CityMapTest(unittest.TestCase):
+    def test_shortest_path_follows_changes(self):
+        city_map = app.CityMap()
+        for name in "ABC":
+            city_map.add_city(name)
+        city_map.add_road("A", "B", 1)
+        city_map.add_road("B", "C", 1)
+        city_map.add_road("A", "C", 5)
+        self.assertEqual(city_map.shortest_path("A", "C"), (2, ["A", "B", "C"]))
+
+        # кеш CSR сбрасывается при изменении карты
+        city_map.remove_road("B", "C", 1)
+        self.assertEqual(city_map.shortest_path("A", "C"), (5, ["A", "C"]))
+        city_map.remove_road("A", "C")
+        self.assertIsNone(city_map.shortest_path("A", "C"))
+
+    def test_loaded_costs_are_integers(self):
+        city_map = app.CityMap()
+        city_map.from_dict({'cities': {'A': {'B': [2.0, 3]}, 'B': {'A': [2.0, 3]}}, '_version': '1.2'})
+        self.assertEqual(list(city_map.to_csr()[3]), [2, 3, 2, 3])
+        with self.assertRaises(ValueError):
+            city_map.from_dict({'cities': {'A': {'B': [2.5]}, 'B': {}}, '_version': '1.2'})
+
+    def test_rename_keeps_roads_symmetric(self):
+        city_map = app.CityMap()
+        for name in "AB":
+            city_map.add_city(name)
+        city_map.add_road("A", "B", 3)
+        city_map.add_road("A", "A", 4)
+        self.assertTrue(city_map.rename_city("A", "Z"))
+        self.assertEqual(roads(city_map), {"Z": {"B": [3], "Z": [4]}, "B": {"Z": [3]}})
+        self.assertEqual(sorted(city_map.get_all_roads()), [("B", "Z", [3]), ("Z", "Z", [4])])
+
+
+class CityNameTest(unittest.TestCase):
+    def test_name_pattern(self):
+        for name in ["Санкт-Петербург", "Martha's Vineyard", "Frankfurt (Oder)", "x" * 64]:
+            self.assertTrue(app.CITY_NAME_RE.fullmatch(name), name)
+        for name in ["", "a\tb", "a\nb", "x" * 65]:
+            self.assertFalse(app.CITY_NAME_RE.fullmatch(name), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,48 @@
+import logging
+import logging.handlers
+import queue
+import sys
 import time
 import random
 import threading
-from queue import Queue
+from collections import deque
 
+# как часто простаивающий обработчик заново пытается украсть работу у соседей
+STEAL_INTERVAL = 0.05
+# сколько запросов подряд можно взять под текущее состояние принтера,
+# пока запросы другого типа ждут своей очереди
+MAX_SAME_STATE_RUN = 4
 
-# паттерн Состояние для настройки принтера
+# журнал событий: рабочие потоки только кладут записи в очередь,
+# в stdout пишет один фоновый поток
+logger = logging.getLogger(__name__)
+
+
+def setup_logging():
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+
+# паттерн Состояние для настройки принтера; состояния не хранят данных,
+# поэтому каждый класс состояния создаёт ровно один экземпляр
 class PrinterState:
+    _instances = {}
+
+    def __new__(cls):
+        try:
+            return PrinterState._instances[cls]
+        except KeyError:
+            instance = PrinterState._instances[cls] = super().__new__(cls)
+            return instance
+
     def configure(self, printer):
         pass
 
@@ -15,41 +52,58 @@ class PrinterState:
 
 class A4State(PrinterState):
     def configure(self, printer):
-        print(f"{printer.name}: Настройка для печати A4")
+        logger.info("%s: Настройка для печати A4", printer.name)
         time.sleep(1)
 
     def print_doc(self, content, printer):
-        print(f"{printer.name}: Печать A4 документа: {content}")
+        logger.info("%s: Печать A4 документа: %s", printer.name, content)
         time.sleep(2)
 
 
 class PhotoState(PrinterState):
     def configure(self, printer):
-        print(f"{printer.name}: Настройка для печати фотографий")
+        logger.info("%s: Настройка для печати фотографий", printer.name)
         time.sleep(1)
 
     def print_doc(self, content, printer):
-        print(f"{printer.name}: Печать фотографии: {content}")
+        logger.info("%s: Печать фотографии: %s", printer.name, content)
         time.sleep(3)
 
 
+# общие экземпляры состояний; A4State() и PhotoState() возвращают их же
+A4_STATE = A4State()
+PHOTO_STATE = PhotoState()
+STATE_BY_TYPE = {'A4': A4_STATE, 'photo': PHOTO_STATE}
+
+
+# принтер принадлежит одному рабочему потоку, поэтому блокировки не нужны
 class Printer:
     def __init__(self, name):
         self.name = name
-        self.state = random.choice([A4State(), PhotoState()])
-        self.lock = threading.Lock()
+        self.state = random.choice([A4_STATE, PHOTO_STATE])
+        # состояние, под которое принтер уже настроен
+        self._configured_state = None
 
     def set_state(self, state):
-        with self.lock:
+        # смена состояния сбрасывает настройку, то же самое состояние - сохраняет
+        if state is not self.state:
             self.state = state
+            self.invalidate_config()
 
     def configure(self):
-        with self.lock:
-            self.state.configure(self)
+        # подряд идущие задания одного типа настраивают принтер только один раз
+        if self.state is self._configured_state:
+            logger.info("%s: Принтер уже настроен, настройка пропущена", self.name)
+            return
+        self.state.configure(self)
+        self._configured_state = self.state
+
+    # следующий configure настроит принтер заново
+    def invalidate_config(self):
+        self._configured_state = None
 
     def print_document(self, content):
-        with self.lock:
-            self.state.print_doc(content, self)
+        self.state.print_doc(content, self)
 
 
 # цепочка обязанностей для обработки запросов
@@ -58,12 +112,18 @@ class PrinterHandler:
         self.successor = successor
 
     def handle_request(self, request):
-        if self.can_handle(request):
-            self.process_request(request)
-        elif self.successor:
-            self.successor.handle_request(request)
+        handler = self.resolve(request)
+        if handler is None:
+            logger.info("Запрос не может быть обработан: %s", request)
         else:
-            print(f"Запрос не может быть обработан: {request}")
+            handler.process_request(request)
+
+    # первое звено цепочки, способное обработать запрос, или None
+    def resolve(self, request):
+        handler = self
+        while handler is not None and not handler.can_handle(request):
+            handler = handler.successor
+        return handler
 
     def can_handle(self, request):
         pass
@@ -78,13 +138,14 @@ class BlackAndWhiteHandler(PrinterHandler):
         self.printer = printer
 
     def can_handle(self, request):
-        return not request['needs_color']
+        return not request.needs_color
 
     def process_request(self, request):
-        print(f"\nЧ/Б принтер {self.printer.name} начинает обработку запроса {request['id']}:")
-        self.printer.set_state(A4State() if request['type'] == 'A4' else PhotoState())
+        logger.info("\nЧ/Б принтер %s начинает обработку запроса %s:",
+                    self.printer.name, request.id)
+        self.printer.set_state(STATE_BY_TYPE[request.type])
         self.printer.configure()
-        self.printer.print_document(request['content'])
+        self.printer.print_document(request.content)
 
 
 class ColorHandler(PrinterHandler):
@@ -93,13 +154,14 @@ class ColorHandler(PrinterHandler):
         self.printer = printer
 
     def can_handle(self, request):
-        return request['needs_color']
+        return request.needs_color
 
     def process_request(self, request):
-        print(f"\nЦветной принтер {self.printer.name} начинает обработку запроса {request['id']}:")
-        self.printer.set_state(A4State() if request['type'] == 'A4' else PhotoState())
+        logger.info("\nЦветной принтер %s начинает обработку запроса %s:",
+                    self.printer.name, request.id)
+        self.printer.set_state(STATE_BY_TYPE[request.type])
         self.printer.configure()
-        self.printer.print_document(request['content'])
+        self.printer.print_document(request.content)
 
 
 # паттерн Заместитель для фотографий
@@ -110,7 +172,7 @@ class PhotoService:
 
 class RealPhotoService(PhotoService):
     def take_photo(self):
-        print("Сервис фотографирования: создание фотографии...")
+        logger.info("Сервис фотографирования: создание фотографии...")
         time.sleep(2)
         return f"Фото-{random.randint(1, 100)}"
 
@@ -122,85 +184,251 @@ class PhotoServiceProxy(PhotoService):
         self.lock = threading.Lock()
 
     def take_photo(self):
+        # быстрый путь без блокировки: после создания фотография не меняется,
+        # а чтение одной ссылки атомарно
+        photo = self.cached_photo
+        if photo is None:
+            # блокировка нужна, только пока фотографии нет: её создаёт ровно один поток
+            with self.lock:
+                photo = self.cached_photo
+                if photo is None:
+                    logger.info("Прокси: запрос на создание новой фотографии...")
+                    self.cached_photo = photo = self.real_service.take_photo()
+                    return photo
+        logger.info("Прокси: использование сохраненной фотографии")
+        return photo
+
+
+# запрос на печать; поля хранятся в слотах, а не в словаре
+class Request:
+    __slots__ = ('id', 'type', 'needs_color', 'has_photo', 'content')
+
+    def __init__(self, request_id, doc_type, needs_color, has_photo):
+        self.id = request_id
+        self.type = doc_type
+        self.needs_color = needs_color
+        self.has_photo = has_photo
+        self.content = None
+
+    def __repr__(self):
+        return (f"Request(id={self.id}, type={self.type!r}, needs_color={self.needs_color}, "
+                f"has_photo={self.has_photo}, content={self.content!r})")
+
+
+# генератор случайных запросов: все случайные значения выбираются сразу
+# для всей пачки, а не по несколько вызовов random на каждый запрос
+def generate_requests(count):
+    doc_types = random.choices(['A4', 'photo'], k=count)
+    colors = random.choices([True, False], k=count)
+    photos = random.choices([True, False], k=count)
+    return [
+        Request(request_id, doc_type,
+                color if doc_type == 'A4' else True,
+                photo if doc_type == 'photo' else False)
+        for request_id, doc_type, color, photo
+        in zip(range(1, count + 1), doc_types, colors, photos)
+    ]
+
+
+# рабочий поток со своим принтером (через обработчик) и своей очередью запросов:
+# владелец берёт запросы с правого конца, простаивающие соседи крадут с левого.
+# Очередь разложена по состоянию принтера, которое нужно запросу: сначала берутся
+# запросы под текущее состояние, чтобы не перенастраивать принтер
+class Worker:
+    def __init__(self, handler, stop_event):
+        self.handler = handler
+        self.stop_event = stop_event
+        self.requests = {state: deque() for state in STATE_BY_TYPE.values()}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # сколько последних запросов подряд требовали одного состояния принтера
+        self.same_state_run = 0
+
+    def push(self, request):
         with self.lock:
-            if not self.cached_photo:
-                print("Прокси: запрос на создание новой фотографии...")
-                self.cached_photo = self.real_service.take_photo()
-            else:
-                print("Прокси: использование сохраненной фотографии")
-            return self.cached_photo
-
-
-# генератор случайных запросов
-def generate_request(request_id):
-    doc_type = random.choice(['A4', 'photo'])
-    needs_color = random.choice([True, False]) if doc_type == 'A4' else True
-    has_photo = random.choice([True, False]) if doc_type == 'photo' else False
-    return {
-        'id': request_id,
-        'type': doc_type,
-        'needs_color': needs_color,
-        'has_photo': has_photo,
-        'content': None
-    }
+            self.requests[STATE_BY_TYPE[request.type]].appendleft(request)
+        self.wakeup.set()
+
+    def preferred_buckets(self, requests):
+        # очередь под текущее состояние своего принтера - первой, остальные - следом;
+        # после MAX_SAME_STATE_RUN таких запросов подряд первыми идут остальные,
+        # чтобы поток запросов одного типа не задерживал другие без конца
+        preferred = requests[self.handler.printer.state]
+        others = [bucket for bucket in requests.values() if bucket is not preferred]
+        if self.same_state_run >= MAX_SAME_STATE_RUN:
+            return others + [preferred]
+        return [preferred] + others
+
+    def served(self, request):
+        if STATE_BY_TYPE[request.type] is self.handler.printer.state:
+            self.same_state_run += 1
+        else:
+            self.same_state_run = 1
+        return request
+
+    def steal_from(self, victim):
+        # чужую очередь не ждём: занята - пробуем следующую
+        if not victim.lock.acquire(blocking=False):
+            return None
+        try:
+            # за один захват блокировки забираем половину запросов из одной чужой
+            # очереди, предпочитая те, что подходят к состоянию своего принтера
+            stolen = []
+            for bucket in self.preferred_buckets(victim.requests):
+                if bucket:
+                    stolen = [bucket.popleft() for _ in range(max(1, len(bucket) // 2))]
+                    break
+        finally:
+            victim.lock.release()
+
+        if not stolen:
+            return None
+        # самый старый из украденных обрабатываем сразу, остальные - следующими
+        request = stolen.pop()
+        if stolen:
+            with self.lock:
+                self.requests[STATE_BY_TYPE[request.type]].extend(stolen)
+        return request
+
+    def next_request(self, peers):
+        # возвращает None, когда запросов больше не будет
+        while True:
+            self.wakeup.clear()
+            # флаг читаем до проверки очередей: все запросы отправлены раньше,
+            # чем он выставлен, поэтому после пустых очередей можно выходить
+            stopping = self.stop_event.is_set()
+            with self.lock:
+                for bucket in self.preferred_buckets(self.requests):
+                    if bucket:
+                        return self.served(bucket.pop())
+
+            for victim in random.sample(peers, len(peers)):
+                request = self.steal_from(victim)
+                if request is not None:
+                    return self.served(request)
+
+            if stopping:
+                return None
+            self.wakeup.wait(STEAL_INTERVAL)
+
+
+# рабочие потоки с принтерами одного вида; воровать запросы можно только
+# внутри группы, чтобы цветной запрос не попал на ч/б принтер
+class WorkerPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.next_index = 0
+
+    def can_handle(self, request):
+        return self.workers[0].handler.can_handle(request)
+
+    def push(self, request):
+        # раздаём запросы по кругу
+        self.workers[self.next_index].push(request)
+        self.next_index = (self.next_index + 1) % len(self.workers)
+
+    def peers(self, worker):
+        return [peer for peer in self.workers if peer is not worker]
+
+
+# звено цепочки на стороне отправки: передаёт запрос в свою группу принтеров
+class PoolHandler(PrinterHandler):
+    def __init__(self, pool, successor=None):
+        super().__init__(successor)
+        self.pool = pool
+
+    def can_handle(self, request):
+        return self.pool.can_handle(request)
+
+    def process_request(self, request):
+        self.pool.push(request)
+
+
+# звено цепочки зависит только от цвета и типа запроса: цепочка проходится
+# один раз на каждую пару, дальше выбранное звено берётся из таблицы
+class RequestRouter(PrinterHandler):
+    def __init__(self, chain):
+        super().__init__()
+        self.chain = chain
+        self.routes = {}
+
+    def resolve(self, request):
+        key = (request.needs_color, request.type)
+        try:
+            return self.routes[key]
+        except KeyError:
+            handler = self.chain.resolve(request)
+            self.routes[key] = handler
+            return handler
 
 
 # обработчик запросов
-def request_processor(handler, photo_proxy, request_queue):
+def request_processor(photo_proxy, worker, peers):
     while True:
-        request = request_queue.get()
-        if request is None:  # сигнал завершения
+        request = worker.next_request(peers)
+        if request is None:  # запросы закончились
             break
 
-        print(f"\n{'=' * 40}\nПолучен запрос {request['id']}:")
-        print(f"Тип: {request['type']}, Цвет: {request['needs_color']}, Фото: {request['has_photo']}")
+        logger.info("\n%s\nПолучен запрос %s:\nТип: %s, Цвет: %s, Фото: %s",
+                    '=' * 40, request.id, request.type,
+                    request.needs_color, request.has_photo)
 
-        if request['type'] == 'photo' and not request['has_photo']:
-            request['content'] = photo_proxy.take_photo()
+        if request.type == 'photo' and not request.has_photo:
+            request.content = photo_proxy.take_photo()
         else:
-            request['content'] = f"Документ-{request['id']}"
+            request.content = f"Документ-{request.id}"
 
-        handler.handle_request(request)
-        request_queue.task_done()
+        # группу, способную обработать запрос, уже выбрал маршрутизатор,
+        # поэтому повторный проход по цепочке с проверкой can_handle не нужен
+        worker.handler.process_request(request)
 
 
 def main():
-    # инициализация компонентов
-    bw_printer = Printer("Ч/Б-Принтер-1")
-    color_printer = Printer("Цветной-Принтер-1")
-    color_handler = ColorHandler(color_printer)
-    bw_handler = BlackAndWhiteHandler(bw_printer, color_handler)
-    photo_proxy = PhotoServiceProxy()
+    log_listener = setup_logging()
 
-    # очередь для запросов
-    request_queue = Queue()
+    # инициализация компонентов: по рабочему потоку на принтер; цветных
+    # запросов больше (все фото и часть A4), поэтому цветных принтеров два
+    photo_proxy = PhotoServiceProxy()
+    stop_event = threading.Event()
+    pools = [
+        WorkerPool([Worker(BlackAndWhiteHandler(Printer("Ч/Б-Принтер-1")), stop_event)]),
+        WorkerPool([Worker(ColorHandler(Printer(f"Цветной-Принтер-{n}")), stop_event)
+                    for n in (1, 2)]),
+    ]
+    # цепочка обязанностей из групп принтеров: ч/б -> цветные
+    router = RequestRouter(PoolHandler(pools[0], PoolHandler(pools[1])))
 
     # создаем и запускаем обработчики запросов
-    num_workers = 3
-    workers = []
-    for _ in range(num_workers):
-        worker = threading.Thread(
-            target=request_processor,
-            args=(bw_handler, photo_proxy, request_queue)
-        )
-        worker.start()
-        workers.append(worker)
+    threads = []
+    for pool in pools:
+        for worker in pool.workers:
+            thread = threading.Thread(
+                target=request_processor,
+                args=(photo_proxy, worker, pool.peers(worker))
+            )
+            thread.start()
+            threads.append(thread)
 
     # генерация случайных запросов в случайное время
-    for i in range(1, 6):
-        time.sleep(random.uniform(0.5, 2.0))  # имитация нерегулярного поступления запросов
-        request = generate_request(i)
-        print(f"\nПользователь отправил запрос {i} в {time.strftime('%H:%M:%S')}")
-        request_queue.put(request)
-
-    # ожидание завершения всех задач
-    request_queue.join()
-
-    # остановка рабочих потоков
-    for _ in range(num_workers):
-        request_queue.put(None)
-    for worker in workers:
-        worker.join()
+    requests = generate_requests(5)
+    delays = [random.uniform(0.5, 2.0) for _ in requests]
+    for request, delay in zip(requests, delays):
+        time.sleep(delay)  # имитация нерегулярного поступления запросов
+        logger.info("\nПользователь отправил запрос %s в %s", request.id, time.strftime('%H:%M:%S'))
+
+        # запрос сразу направляется в группу принтеров, которая может его обработать
+        router.handle_request(request)
+
+    # остановка рабочих потоков: каждый дорабатывает оставшиеся запросы и выходит,
+    # когда ни в своей очереди, ни у соседей работы не осталось
+    stop_event.set()
+    for pool in pools:
+        for worker in pool.workers:
+            worker.wakeup.set()
+    for thread in threads:
+        thread.join()
+
+    log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+import importlib.util
+import os
+import random
+import threading
+import time
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_spec = importlib.util.spec_from_file_location("print_service", os.path.join(HERE, "3.py"))
+printing = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(printing)
+
+
+class RecordingHandler:
+    """Обработчик без задержек и вывода: запоминает id обработанных запросов"""
+
+    def __init__(self, name):
+        self.printer = printing.Printer(name)
+        self.processed = []
+
+    def process_request(self, request):
+        self.printer.set_state(printing.STATE_BY_TYPE[request.type])
+        self.processed.append(request.id)
+
+
+def run_workers(workers, pool):
+    def run(worker):
+        peers = pool.peers(worker)
+        while (request := worker.next_request(peers)) is not None:
+            worker.handler.process_request(request)
+            time.sleep(random.random() / 5000)
+
+    threads = [threading.Thread(target=run, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+class WorkStealingTest(unittest.TestCase):
+    def test_every_request_processed_exactly_once(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                random.seed(seed)
+                stop_event = threading.Event()
+                workers = [printing.Worker(RecordingHandler(f"p{n}"), stop_event) for n in range(3)]
+                pool = printing.WorkerPool(workers)
+                threads = run_workers(workers, pool)
+
+                # все запросы попадают к первым двум, третий работает только кражей
+                requests = printing.generate_requests(300)
+                for i, request in enumerate(requests):
+                    workers[i % 2].push(request)
+                stop_event.set()
+                for worker in workers:
+                    worker.wakeup.set()
+                for thread in threads:
+                    thread.join()
+
+                processed = sorted(i for worker in workers for i in worker.handler.processed)
+                self.assertEqual(processed, [request.id for request in requests])
+
+    def test_steal_takes_newer_half_of_a_queue(self):
+        stop_event = threading.Event()
+        victim, thief = (printing.Worker(RecordingHandler(name), stop_event) for name in "vt")
+        for i in range(6):
+            victim.push(printing.Request(i, 'A4', False, False))
+
+        # вор забирает три самых новых запроса и начинает со старейшего из них
+        self.assertEqual(thief.steal_from(victim).id, 3)
+        self.assertEqual([thief.next_request([]).id for _ in range(2)], [4, 5])
+        self.assertEqual([r.id for r in victim.requests[printing.A4_STATE]], [2, 1, 0])
+
+    def test_same_state_run_is_bounded(self):
+        worker = printing.Worker(RecordingHandler("p"), threading.Event())
+        worker.handler.printer.set_state(printing.A4_STATE)
+        worker.push(printing.Request(0, 'photo', True, False))
+        for i in range(1, 11):
+            worker.push(printing.Request(i, 'A4', True, False))
+
+        order = []
+        for _ in range(11):
+            request = worker.next_request([])
+            worker.handler.process_request(request)
+            order.append(request.id)
+        self.assertLessEqual(order.index(0), printing.MAX_SAME_STATE_RUN)
+        self.assertEqual(sorted(order), list(range(11)))
+
+
+class PrinterTest(unittest.TestCase):
+    def test_states_are_singletons(self):
+        self.assertIs(printing.A4State(), printing.A4_STATE)
+        self.assertIs(printing.PhotoState(), printing.PHOTO_STATE)
+
+    def test_configure_is_skipped_until_state_changes(self):
+        printer = printing.Printer("p")
+        # настоящая настройка ждёт секунду, в тесте важно только число вызовов
+        with mock.patch.object(printing.A4State, "configure") as configure:
+            printer.set_state(printing.A4_STATE)
+            printer.configure()
+            printer.set_state(printing.A4_STATE)
+            printer.configure()
+            self.assertEqual(configure.call_count, 1)
+
+            printer.set_state(printing.PHOTO_STATE)
+            printer.set_state(printing.A4_STATE)
+            printer.configure()
+            self.assertEqual(configure.call_count, 2)
+            printer.invalidate_config()
+            printer.configure()
+            self.assertEqual(configure.call_count, 3)
+
+    def test_router_picks_pool_by_color(self):
+        stop_event = threading.Event()
+        bw = printing.WorkerPool([printing.Worker(
+            printing.BlackAndWhiteHandler(printing.Printer("bw")), stop_event)])
+        color = printing.WorkerPool([printing.Worker(
+            printing.ColorHandler(printing.Printer("color")), stop_event)])
+        router = printing.RequestRouter(printing.PoolHandler(bw, printing.PoolHandler(color)))
+        self.assertIs(router.resolve(printing.Request(1, 'A4', False, False)).pool, bw)
+        self.assertIs(router.resolve(printing.Request(2, 'photo', True, True)).pool, color)
+        self.assertIs(router.resolve(printing.Request(3, 'A4', True, False)).pool, color)
+
+    def test_chain_delivers_or_rejects(self):
+        stop_event = threading.Event()
+        worker = printing.Worker(printing.BlackAndWhiteHandler(printing.Printer("bw")), stop_event)
+        router = printing.RequestRouter(printing.PoolHandler(printing.WorkerPool([worker])))
+
+        router.handle_request(printing.Request(1, 'A4', False, False))
+        self.assertEqual([r.id for r in worker.requests[printing.A4_STATE]], [1])
+        with self.assertLogs(printing.logger, level="INFO"):
+            router.handle_request(printing.Request(2, 'A4', True, False))
+        self.assertEqual(len(worker.requests[printing.A4_STATE]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()